@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Run the ExfoJobj pipeline over a tree of wafer directories.
+
+Every directory under root that holds a base scan (b*.tdms, .dat or .npc)
+is one exfoliation, directories inside it are part of that wafer. Each
+goes through Load_Batch, Wafer_Sync, Wafer_Make, Get_Stress, Make_Load and
+Export_Load in a pool of worker processes, with the metamodel built once
+and handed to the workers read only, as its closed form quadratic where
+the kernel allows it.
+
+A wafer is skipped when its load profile was written from the same scans,
+parameters and metamodel (recorded in <wafer>/<name>_load.json) and every
+profile file still passes Export.check against the stamp recorded with
+it, so a damaged or stale profile is written again. A summary table of
+per wafer stats is written to root/summary.csv.
+
+    python Batch.py wafers/ --params params.json --workers 4
+
+params.json overrides any of DEFAULTS, e.g.
+
+    {"llim": 40, "ulim": 65, "load": {"ex": 4},
+     "meta": {"csv": "data/ansys_dat_122.csv", "cache": "data/meta_cache"}}
+"""
+import argparse
+import copy
+import csv
+import json
+import logging
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+import ExfoJobj
+import Export
+import Instrument
+import MetaModel
+import ScanCache
+import StageCache
+
+log = Instrument.log
+
+DEFAULTS = {
+    'llim': 40,
+    'ulim': 65,
+    'filt': 1000,
+    'resamp': True,
+    'd': 'f',
+    'wafer': {'w': .545, 'wo': .017, 'glass': 1.8631, 'k': .101, 'filt': 11},
+    'stress': {'win': 50, 'wafer_thickness': 580E-6, 'filt': 5},
+    'load': {'ex': 4, 'a': 1500, 'h': 150, 'k2': 0, 'k1': 730, 'filt': 5, 'floor': 5},
+    # fmt 'csv' or a binary setpoint table format of Export
+    'export': {'wafer_points': 2500, 'ramp': 200, 'window': 5500, 'fmt': 'csv'},
+    # one of csv (Make_Meta, with cache and i), pickle (Load_Meta) or quad (Import_Meta)
+    'meta': {'csv': 'data/ansys_dat_122.csv', 'i': 2, 'cache': None},
+}
+SUFFIXES = ('.tdms', '.dat', ScanCache.SUFFIX)
+# summary columns: Ni layer mean and std, Si layer (Ex.ex) std and its
+# relative variation std/mean, mean distance of Ex.ex from the target
+# thickness load['ex'], Load (N) mean, min and max and its points
+SUMMARY = ('wafer', 'status', 'ni_mean_um', 'ni_std_um', 'si_std_um', 'si_uniformity',
+           'ex_error_um', 'load_mean', 'load_min', 'load_max', 'points')
+
+# metamodel of a worker process, set by _init
+_META = None
+
+
+def merge(base, new):
+    """Nested dict update, new wins."""
+    out = copy.deepcopy(base)
+    for k, v in new.items():
+        if isinstance(v, dict) and isinstance(out.get(k), dict):
+            out[k] = merge(out[k], v)
+        else:
+            out[k] = v
+    return out
+
+
+def wafers(root):
+    """Directories below root holding a base scan, sorted, without those inside a wafer."""
+    root = Path(root)
+    found = []
+    for wafer in sorted(set(path.parent for path in root.rglob('b*')
+                            if path.suffix in SUFFIXES and path.parent != root)):
+        if not any(w in wafer.parents for w in found):
+            found.append(wafer)
+    return found
+
+
+def make_meta(meta):
+    """
+    Build the metamodel described by params['meta'].
+
+    Returns
+    -------
+    MetaModel.QuadMeta or tuple
+        the closed form where the kernel has one, else (scalerX, scalery, gpr)
+    """
+    Ex = ExfoJobj.ExfoJobj('meta')
+    if meta.get('quad'):
+        return MetaModel.QuadMeta.load(meta['quad'])
+    if meta.get('pickle'):
+        path = Path(meta['pickle'])
+        Ex.Load_Meta(path.parent, path.name)
+    else:
+        Ex.Make_Meta(meta['csv'], i=meta.get('i', 2), mode=meta.get('mode', 'exact'),
+                     cache=meta.get('cache'))
+    quad = Ex.Meta().quad
+    if quad is not None:
+        return quad
+    return Ex.scalerX, Ex.scalery, Ex.gpr
+
+
+def _init(meta, level):
+    global _META
+    _META = meta
+    log.setLevel(level)
+
+
+def _use_meta(Ex, meta):
+    if isinstance(meta, tuple):
+        Ex.scalerX, Ex.scalery, Ex.gpr = meta
+        Ex.meta = None
+    else:
+        Ex.meta = meta
+
+
+def stamp(wafer, params, meta):
+    """Fingerprint of the scans, parameters and metamodel a load profile comes from."""
+    sources = [ScanCache.source_stamp(f, digest=False) for f in sorted(Path(wafer).iterdir())
+               if f.is_file() and f.suffix in SUFFIXES[:2]]
+    if isinstance(meta, tuple):
+        meta = MetaModel.GPRInference(meta[2], meta[0], meta[1])
+    return StageCache.fingerprint(sources, params, meta)
+
+
+def stats(Ex, ex_target):
+    """Per wafer summary values, thicknesses in um."""
+    Load = np.squeeze(Ex.Load)
+    row = {'ni_mean_um': Ex.ni.mean()*1E6, 'ni_std_um': Ex.ni.std()*1E6,
+           'load_mean': Load.mean(), 'load_min': Load.min(), 'load_max': Load.max(),
+           'points': Load.shape[0]}
+    if hasattr(Ex, 'ex'):
+        row['si_std_um'] = Ex.ex.std()*1E6
+        row['si_uniformity'] = Ex.ex.std()/Ex.ex.mean()
+        row['ex_error_um'] = abs(Ex.ex*1E6-ex_target).mean()
+    return {k: float(v) for k, v in row.items()}
+
+
+def process(wafer, params, force=False, meta=None):
+    """
+    Run the pipeline on one wafer directory unless its output is up to date.
+
+    Returns
+    -------
+    dict
+        summary row
+    """
+    meta = _META if meta is None else meta
+    wafer = Path(wafer)
+    name = wafer.name
+    out = wafer.joinpath(name + '_load.json')
+    key = stamp(wafer, params, meta)
+    if not force and out.exists():
+        with open(out) as f:
+            done = json.load(f)
+        files = done.get('profiles') or {}
+        if done.get('stamp') == key and files and all(
+                Export.check(f, s) for f, s in files.items()):
+            log.info('Up to date %s', name)
+            return {'wafer': str(wafer), 'status': 'skipped', **done['stats']}
+    try:
+        with Instrument.timer('wafer', wafer=name):
+            Ex = ExfoJobj.ExfoJobj(name)
+            _use_meta(Ex, meta)
+            Ex.Load_Batch(wafer, filt=params['filt'], llim=params['llim'], ulim=params['ulim'])
+            resamp = (params['llim'], params['ulim']) if params['resamp'] else False
+            Ex.Wafer_Sync(d=params['d'], resamp=resamp)
+            Ex.Wafer_Make(**params['wafer'])
+            Ex.Get_Stress(**params['stress'])
+            Ex.Make_Load(**params['load'])
+            written = Ex.Export_Load(wafer, name + '_load', **params['export'])
+    except Exception as e:
+        Instrument.event('wafer_error', 'Failed {}: {!r}'.format(name, e), logging.ERROR,
+                         wafer=name)
+        return {'wafer': str(wafer), 'status': 'error: {!r}'.format(e)}
+    row = stats(Ex, params['load']['ex'])
+    with open(out, 'w') as f:
+        json.dump({'stamp': key, 'params': params, 'stats': row,
+                   'profiles': {str(path): stamp for path, stamp in written}}, f, indent=1)
+    return {'wafer': str(wafer), 'status': 'done', **row}
+
+
+def run(root, params=None, workers=None, force=False, summary='summary.csv'):
+    """
+    Process every wafer under root and write the summary table.
+
+    Parameters
+    ----------
+    root : Path
+        directory tree of wafer directories
+    params : dict, optional
+        overrides of DEFAULTS
+    workers : int, optional
+        worker processes. The default is None, one after another.
+    force : bool, optional
+        rerun wafers that are up to date. The default is False.
+    summary : String, optional
+        summary csv, relative to root. The default is 'summary.csv'.
+
+    Returns
+    -------
+    list
+        summary rows
+    """
+    params = merge(DEFAULTS, params or {})
+    meta = make_meta(params.pop('meta'))
+    found = wafers(root)
+    log.info('%d wafers under %s', len(found), root)
+    if workers:
+        with ProcessPoolExecutor(workers, initializer=_init,
+                                 initargs=(meta, log.getEffectiveLevel())) as pool:
+            rows = [*pool.map(process, found, [params]*len(found), [force]*len(found))]
+    else:
+        rows = [process(w, params, force, meta) for w in found]
+    path = Path(root).joinpath(summary)
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, SUMMARY, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(rows)
+    log.info('Summary in %s', path)
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('root', help='directory tree of wafer directories')
+    parser.add_argument('--params', help='JSON file overriding the default parameters')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--force', action='store_true', help='rerun up to date wafers')
+    parser.add_argument('--summary', default='summary.csv')
+    parser.add_argument('--trace', help='JSON lines trace file')
+    parser.add_argument('-q', '--quiet', action='store_true')
+    args = parser.parse_args(argv)
+
+    if not args.quiet:
+        Instrument.console()
+    if args.trace:
+        Instrument.trace(args.trace)
+    params = {}
+    if args.params:
+        with open(args.params) as f:
+            params = json.load(f)
+    rows = run(args.root, params, args.workers, args.force, args.summary)
+    return 1 if any(r['status'].startswith('error') for r in rows) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
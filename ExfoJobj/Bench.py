@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of the pipeline stages on the bundled data.
+
+Every stage is timed on its own (best of repeat runs) and run once more
+under tracemalloc for its peak memory: tdms parse, legacy pickle load,
+the parts of Scan construction, Load_Batch, Wafer_Sync, Wafer_Make,
+Get_Stress, Make_Meta, Make_Load and Export_Load for each data set, and
+Scan construction on synthetic scans made by repeating a real scan's
+passes 10-100 times. Cold import of the compute modules is timed in a
+fresh interpreter, with the plotting and fitting packages it pulled in.
+The metamodel is read from data/meta_cache (--cache), trained into it by
+the first run. In-memory memos are cleared or rebuilt before every run so
+each one does the stage's work; Make_Load answered from the prediction
+memo is timed as a row of its own, make_load.memo_hit.
+
+Results can be saved as a baseline JSON and later runs compared with it;
+stages slower than the tolerance or whose result checksum changed are
+reported and make the run exit with 1.
+
+    python Bench.py --save bench.json
+    python Bench.py --compare bench.json
+"""
+import argparse
+import json
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+
+import ExfoJobj
+import Filters
+import ScanCache
+
+HERE = Path(__file__).resolve().parent
+DATA = HERE.joinpath('data')
+SETS = ('example', 'TB4', 'TB6', '12')
+LLIM = 40
+ULIM = 65
+# packages the compute path should only import when used
+HEAVY = ('matplotlib', 'mpl_toolkits', 'scipy', 'sklearn', 'nptdms')
+IMPORT = """
+import sys, time
+t = time.perf_counter()
+import {}
+print(time.perf_counter() - t)
+print(' '.join(m for m in {!r} if m in sys.modules))
+"""
+
+
+def measure(fn, repeat=3, setup=None):
+    """
+    Best time and peak traced memory of fn().
+
+    setup() runs untimed before every run, e.g. to clear a memo so each
+    run does the work again.
+
+    Returns
+    -------
+    seconds : float
+    peak : int
+        bytes allocated at the high-water mark of one traced run
+    out : object
+        what fn returned
+    """
+    best = np.inf
+    for _ in range(repeat):
+        if setup:
+            setup()
+        t = time.perf_counter()
+        out = fn()
+        best = min(best, time.perf_counter() - t)
+    if setup:
+        setup()
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, peak, out
+
+
+def checksum(out):
+    """Sum of a stage's array output, to see that results didn't change."""
+    if isinstance(out, dict):
+        out = [*out.values()]
+    if isinstance(out, (list, tuple)):
+        return float(sum(checksum(o) for o in out))
+    if isinstance(out, np.ndarray) and out.dtype.kind in 'fiu':
+        return float(np.nansum(out))
+    return 0.
+
+
+class Bench(object):
+    """
+    Collects stage results as {name: {'time', 'peak', 'check'}}.
+
+    Parameters
+    ----------
+    repeat : int, optional
+        timed runs per stage, the best is kept. The default is 3.
+    """
+
+    def __init__(self, repeat=3):
+        self.repeat = repeat
+        self.results = {}
+
+    def run(self, name, fn, repeat=None, check=None, setup=None):
+        """Measure fn, check(out) picks the arrays checksummed (default out)."""
+        seconds, peak, out = measure(fn, self.repeat if repeat is None else repeat, setup)
+        self.results[name] = {'time': seconds, 'peak': peak,
+                              'check': checksum(out if check is None else check(out))}
+        print('{:<36} {:9.4f} s {:9.1f} MB'.format(name, seconds, peak/1E6))
+        return out
+
+
+def bench_import(bench, module, repeat=None):
+    """
+    Cold import of module, best of repeat fresh interpreters.
+
+    The check is the number of HEAVY packages the import loaded, so a
+    module level import of one of them shows up as a changed result.
+    """
+    best = np.inf
+    for _ in range(bench.repeat if repeat is None else repeat):
+        out = subprocess.run([sys.executable, '-c', IMPORT.format(module, HEAVY)], cwd=HERE,
+                             capture_output=True, text=True, check=True).stdout.split('\n')
+        best = min(best, float(out[0]))
+    heavy = out[1].split()
+    bench.results['import.' + module] = {'time': best, 'peak': 0, 'check': float(len(heavy))}
+    print('{:<36} {:9.4f} s {}'.format('import.' + module, best, ' '.join(heavy)))
+    return heavy
+
+
+def bench_meta(bench, cache, train=False):
+    """Metamodel for Make_Load, trained (and timed) or read from the cache directory."""
+    csv = DATA.joinpath('ansys_dat_122.csv')
+    if train:
+        def make_meta():
+            # a new object each run, Make_Meta returns early for a model it has
+            Ex = ExfoJobj.ExfoJobj('meta')
+            Ex.Make_Meta(csv)
+            return Ex
+        Ex = bench.run('make_meta', make_meta, repeat=1)
+    else:
+        Ex = ExfoJobj.ExfoJobj('meta')
+        Ex.Make_Meta(csv, cache=cache)
+    return Ex.scalerX, Ex.scalery, Ex.gpr
+
+
+def bench_set(bench, name, work, meta):
+    """Stages on one bundled data set, copied to work so caches are built there."""
+    directory = work.joinpath(name)
+    shutil.copytree(DATA.joinpath(name), directory)
+    # one base scan of each kind, load scans have another layout
+    tdms = sorted(p for p in directory.glob('*.tdms') if p.name[0] != 'l')
+    dats = sorted(p for p in directory.glob('*.dat')
+                  if p.name[0] != 'l' and not p.name.endswith('.trim.dat'))
+    if tdms:
+        data = bench.run(name + '.tdms_parse', lambda: ScanCache.from_tdms(tdms[0]))
+    if dats:
+        data, _ = bench.run(name + '.pickle_load', lambda: ScanCache.from_dat(dats[0], 'base'))
+    bench_scan(bench, name, data)
+
+    Ex = ExfoJobj.ExfoJobj(name)
+    Ex.scalerX, Ex.scalery, Ex.gpr = meta
+    # first run builds the .npc caches, the timed ones read them
+    Ex.Load_Batch(directory, filt=1000, llim=LLIM, ulim=ULIM)
+    bench.run(name + '.load_batch',
+              lambda: Ex.Load_Batch(directory, filt=1000, llim=LLIM, ulim=ULIM),
+              check=lambda _: [Ex.base.fmeans[0]])
+    bench.run(name + '.wafer_sync', lambda: Ex.Wafer_Sync(resamp=(LLIM, ULIM)),
+              check=lambda _: [Ex.sync_base, Ex.sync_nickel])
+    bench.run(name + '.wafer_make', lambda: Ex.Wafer_Make(filt=11), check=lambda _: Ex.ni)
+    if hasattr(Ex, 'sync_stress'):
+        bench.run(name + '.get_stress', lambda: Ex.Get_Stress(filt=5), check=lambda _: Ex.S)
+        # GPRInference memoizes predictions, clear it so each run predicts
+        bench.run(name + '.make_load', lambda: Ex.Make_Load(ex=4, filt=5),
+                  check=lambda _: Ex.Load, setup=lambda: Ex.Meta().cache.clear())
+        bench.run(name + '.make_load.memo_hit', lambda: Ex.Make_Load(ex=4, filt=5),
+                  check=lambda _: Ex.Load)
+        bench.run(name + '.export_load', lambda: Ex.Export_Load(
+            work, name + '_load.csv', 2500, 200, window=5500),
+            check=lambda _: np.loadtxt(work.joinpath(name + '_load.csv')))
+
+
+def bench_scan(bench, name, data):
+    """Scan construction and its parts on one scan's channels."""
+    t = np.asarray(data['time'])
+    enc = np.asarray(data['encoder'])
+    lzr = np.asarray(data['laser'])
+    filt = ExfoJobj.exFilter(1000)
+    bench.run(name + '.scan.encoder_median', lambda: Filters.median(enc, 21))
+    scan = bench.run(name + '.scan',
+                     lambda: ExfoJobj.Scan(t, enc, lzr, llim=LLIM, ulim=ULIM, filt=filt),
+                     check=lambda scan: [scan.fmeans[0]])
+    runs = scan.idx[::2]
+    lengths = runs[:, 1]-runs[:, 0]
+    full = np.minimum(runs[:, :1] + np.arange(lengths.max()), lzr.shape[0]-1)
+    bench.run(name + '.scan.laser_filter', lambda: Filters.batch(filt, lzr[full], lengths))
+    bench.run(name + '.scan.enc_groups', lambda: ExfoJobj.enc_groups(
+        scan.eforward, scan.lforward, scan.grid)[0])
+    return scan
+
+
+def synthetic(data, scale):
+    """A scan with scale times the passes, the real passes repeated."""
+    t = np.asarray(data['time'], dtype=float)
+    step = t[1]-t[0] if t.shape[0] > 1 else 1.
+    span = t[-1]-t[0]+step
+    return {'time': (t[None, :] + span*np.arange(scale)[:, None]).ravel(),
+            'encoder': np.tile(np.asarray(data['encoder']), scale),
+            'laser': np.tile(np.asarray(data['laser']), scale)}
+
+
+def compare(results, baseline, tolerance=1.25):
+    """
+    Stages that got slower than tolerance x baseline or changed result.
+
+    Returns
+    -------
+    list
+        (stage, reason) of the regressions
+    """
+    bad = []
+    print('\n{:<36} {:>9} {:>9} {:>7}'.format('stage', 'base s', 'now s', 'ratio'))
+    for name, now in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        ratio = now['time']/base['time'] if base['time'] else np.inf
+        flag = ''
+        if ratio > tolerance:
+            flag = 'SLOWER'
+            bad.append((name, 'time x{:.2f}'.format(ratio)))
+        if not np.isclose(now['check'], base['check'], rtol=1E-6, atol=1E-9):
+            flag += ' CHANGED'
+            bad.append((name, 'result {} != {}'.format(now['check'], base['check'])))
+        print('{:<36} {:9.4f} {:9.4f} {:7.2f} {}'.format(
+            name, base['time'], now['time'], ratio, flag))
+    return bad
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sets', default=','.join(SETS),
+                        help='data sets in data/, comma separated')
+    parser.add_argument('--scales', default='10',
+                        help='synthetic scan sizes as multiples of a real scan, e.g. 10,100')
+    parser.add_argument('--imports', default='ExfoJobj,Batch',
+                        help='modules whose cold import is timed, comma separated')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--meta', action='store_true',
+                        help='time Make_Meta (slow) instead of reading a cached metamodel')
+    parser.add_argument('--cache', default=str(DATA.joinpath('meta_cache')),
+                        help='metamodel cache directory, kept between runs')
+    parser.add_argument('--save', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='baseline JSON to compare with')
+    parser.add_argument('--tolerance', type=float, default=1.25,
+                        help='slowdown ratio reported as a regression')
+    args = parser.parse_args(argv)
+
+    bench = Bench(args.repeat)
+    for module in filter(None, args.imports.split(',')):
+        bench_import(bench, module)
+    work = Path(tempfile.mkdtemp(prefix='exfobench'))
+    try:
+        meta = bench_meta(bench, Path(args.cache), train=args.meta)
+        for name in filter(None, args.sets.split(',')):
+            bench_set(bench, name, work, meta)
+        base = ScanCache.from_tdms(sorted(DATA.joinpath('TB4').glob('*.tdms'))[0])
+        for scale in map(int, filter(None, args.scales.split(','))):
+            bench_scan(bench, 'synthetic_x{}'.format(scale), synthetic(base, scale))
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+    info = {'python': sys.version.split()[0], 'numpy': np.__version__,
+            'date': time.strftime('%Y-%m-%d %H:%M:%S')}
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'info': info, 'results': bench.results}, f, indent=1)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        bad = compare(bench.results, baseline, args.tolerance)
+        for name, reason in bad:
+            print('REGRESSION', name, reason)
+        return 1 if bad else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
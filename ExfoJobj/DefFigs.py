@@ -15,8 +15,6 @@ from scipy import signal
 from scipy.ndimage import uniform_filter1d
 from cycler import cycler
 from AxZoom import *
-from sklearn.decomposition import FastICA, PCA
-from scipy.integrate import cumtrapz
 import AxZoom
 from matplotlib import rcParams
 
@@ -226,7 +224,7 @@ def Make_Ex(Ex, T=1, a=1500, h=150, k2=0, k1=730, filt=None, floor=False):
     Xtest[:, 2] = Ex.S*1E-6
 
     # Compute load with scaling
-    ex = Ex.scalery.inverse_transform(Ex.gpr.predict(Ex.scalerX.transform(Xtest)))
+    ex = Ex.Meta().predict(Xtest)
     # if floor:
     #     Ex.Load[Ex.Load < floor] = floor
     return ex
@@ -15,8 +15,6 @@ from scipy import signal
 from scipy.ndimage import uniform_filter1d
 from cycler import cycler
 from AxZoom import *
-from sklearn.decomposition import FastICA, PCA
-from scipy.integrate import cumtrapz
 import AxZoom
 
 plt.style.use('default')
@@ -154,7 +152,7 @@ def Make_Ex(Ex, T=1, a=1500, h=150, k2=0, k1=730, filt=None, floor=False):
     Xtest[:, 2] = Ex.S*1E-6
 
     # Compute load with scaling
-    ex = Ex.scalery.inverse_transform(Ex.gpr.predict(Ex.scalerX.transform(Xtest)))
+    ex = Ex.Meta().predict(Xtest)
     return ex
 
 
@@ -239,6 +237,7 @@ plt.savefig('figs/repeatd.pdf', dpi=300, transparent=True)
 
 # %% Remove Repeatable Error by Integration
 def plot_PICA(x1, x2, b1, b2):
+    from sklearn.decomposition import FastICA, PCA
     S = np.c_[x1, x2]
     X = np.c_[b1, b2]
     ica = FastICA(n_components=2)
@@ -274,6 +273,7 @@ def plot_PICA(x1, x2, b1, b2):
 
 
 def ICR(t, x1, x2, x3, b1, b2, d, dm=False, n=None, filt=None):
+    from scipy.integrate import cumtrapz
 
     if n is not None:
         noise = filt(np.random.normal(0, abs(b1).mean()*n, b1.shape))
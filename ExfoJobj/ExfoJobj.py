@@ -5,14 +5,56 @@ Created on Mon Mar 23 12:00:22 2020.
 
 @author: myo
 """
-from nptdms import TdmsFile
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+import contextlib
+import logging
+import copy
+import inspect
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-import matplotlib.pyplot as plt
 import pickle
-from scipy import signal
-import AxZoom
-from scipy.ndimage import uniform_filter1d
+import Export
+import Filters
+import Instrument
+import ScanCache
+import MetaModel
+import StageCache
+
+log = Instrument.log
+
+
+def _synced_scans(Ex):
+    """Loaded scans that Wafer_Sync aligns (all but load)."""
+    return [scan for scan in Ex.scans.values() if scan != 'load' and getattr(Ex, scan, False)]
+
+
+def _sync_means(Ex, params):
+    return [getattr(getattr(Ex, scan), fb+'means') for scan in _synced_scans(Ex) for fb in 'fb']
+
+
+def _sync_attrs(Ex):
+    return ['sync', 'sync_sem', 'sync_mask', 'sync_grid', 'sync_names', 'sync_cols',
+            'sync_lag', 'sync_offset', 'sync_d'] + [
+        a for scan in _synced_scans(Ex) for a in ('sync_'+scan, 'sync_'+scan+'_x')]
+
+
+def _batch_sources(Ex, params):
+    # size and mtime of the raw scans (.tdms, .dat, .trim.dat), the .npc caches
+    # are rebuilt from them; exports written next to them don't count
+    return [ScanCache.source_stamp(f, digest=False)
+            for f in sorted(Path(params['directory']).iterdir())
+            if f.is_file() and f.suffix in ('.tdms', '.dat')]
+
+
+def _load_enc0(Ex, params):
+    # encoder of the load scan as loaded, Wafer_Make shifts load.enc itself
+    load = getattr(Ex, 'load', None)
+    return None if load is None else getattr(load, 'enc0', load.enc)
+
+
+def _scan_attrs(Ex):
+    return [scan for scan in Ex.scans.values() if hasattr(Ex, scan)]
 
 
 class ExfoJobj(object):
@@ -50,8 +92,28 @@ class ExfoJobj(object):
 
         """
         self.name = name
+        self.grid = EncGrid()
+        self.stages = None
+
+    def Cache_Stages(self, directory=None, size=32):
+        """
+        Memoize the pipeline stages.
 
-    def Load_Scan(self, filepath, file, trim=False, scan=False, filt=None, llim=26, ulim=74):
+        Load_Batch, Wafer_Sync, Wafer_Make, Get_Stress and Make_Load then
+        restore their results when called again with the same parameters
+        and input data, so changing one parameter only reruns the stages
+        downstream of it. Pass directory to also keep the results on disk.
+
+        Returns
+        -------
+        StageCache.StageCache
+        """
+        self.stages = StageCache.StageCache(directory, size=size)
+        return self.stages
+
+    @Instrument.timer('Load_Scan')
+    def Load_Scan(self, filepath, file, trim=False, scan=False, filt=None, llim=26, ulim=74,
+                  lazy=True):
         """
         Load scan.
 
@@ -60,7 +122,7 @@ class ExfoJobj(object):
         filepath : String
             /path/to/file/
         file : String
-            file (.tdms or .dat)
+            file (.npc cache, .tdms or legacy .dat)
         scan : String
             'base'
             'wafer'
@@ -70,6 +132,9 @@ class ExfoJobj(object):
             'exfo'
         filt : Function, optional
             filtering function lzr = filt(lzr)
+        lazy : bool, optional
+            Memory-map caches and stream tdms channels as they are needed
+            instead of reading whole files. The default is True.
 
         Returns
         -------
@@ -77,69 +142,56 @@ class ExfoJobj(object):
         """
         if not scan:
             scan = self.scans.get(Path(file).name[0], 'base')
-        print(scan)
 
-        if Path(file).suffix == '.tdms':
+        path = Path(filepath).joinpath(file)
+        Instrument.event('load_scan', 'Loading {} ({})'.format(path.name, scan),
+                         file=path.name, scan=scan)
+        if path.suffix == ScanCache.SUFFIX:
+            data, cache_trim = ScanCache.read(path, mmap=lazy)
+            if cache_trim is not False:
+                trim = cache_trim
+        elif path.suffix == '.tdms':
             # import tdms - SLOW
-            print('Loading ', Path(file).name)
-            tdms_file = TdmsFile(Path(Path(filepath).joinpath(file)).with_suffix(".tdms"))
-            group = tdms_file['Untitled']
-            channel1 = group['encoder']
-            enc = channel1.data
-            # zero data and convert to mm
-            # enc=(enc-min(enc)+1)/100
-
-            time = group['Untitled']
-            # elapsed time in seconds
-            time = time - time[0]
-
-            channel2 = group['laser']
-            lzr = channel2.data
-            # zero data and convert to mm
-            # enc = (enc-min(enc)+1) / 100
-            # convert to mm, but leave enc at lv zero
-            # enc = enc / 100
-            channel2 = group['load']
-            lod = channel2.data
-
-        elif 'trim' in Path(file).name:
-            [time, enc, lzr, trim] = pickle.load(
-                open(Path(Path(filepath).joinpath(file)).with_suffix(".dat"), 'rb'))
-            print('Loading ', Path(file).name)
-
-        elif Path(file).suffix == '.dat':
-            if scan == 'load':
-                [time, lod, enc, lzr] = pickle.load(
-                    open(Path(Path(filepath).joinpath(file)).with_suffix(".dat"), 'rb'))
-            else:
-                [time, enc, lzr] = pickle.load(
-                    open(Path(Path(filepath).joinpath(file)).with_suffix(".dat"), 'rb'))
-            print('Loading ', Path(file).name)
-
+            data = ScanCache.from_tdms(path, lazy=lazy)
+        elif path.suffix == '.dat':
+            # legacy pickled scan
+            data, dat_trim = ScanCache.from_dat(path, scan)
+            if dat_trim is not False:
+                trim = dat_trim
         else:
             raise ValueError('file load error')
 
+        enc = data['encoder']
+        lzr = data['laser']
+        # elapsed time in seconds
+        time = data['time']
+        time = time - time[0]
+        if scan == 'load':
+            lod = data['load']
+        if isinstance(data, ScanCache.TdmsChannels):
+            data.close()
+
         if scan == 'load':
             self.Load_Load_Scan(time, lod, enc, lzr, filt=filt, llim=llim, ulim=ulim)
         else:
-            setattr(self, scan, Scan(time, enc, lzr, trim=trim, filt=filt, llim=llim, ulim=ulim))
+            setattr(self, scan, Scan(time, enc, lzr, trim=trim, filt=filt, llim=llim, ulim=ulim,
+                                     grid=self.grid))
 
     def Load_Load_Scan(self, time, lod, enc, lzr, filt=None, llim=26, ulim=74):
         self.load = Lscan()
         tempst = np.stack([enc, lod, lzr, time])
         y = np.delete(tempst, (tempst[0, :] > ulim) | (tempst[0, :] < llim), 1)
         self.load.time = y[3, :]
-        self.load.encr = y[0, :].copy()
-        enc = signal.medfilt(y[0, :], 21)
+        self.load.encr = y[0, :]
+        enc = Filters.median(y[0, :], 21)
         # convert to mm
         enc = enc / 100
         # shift from laser to roller
         enc = enc-32.6
-        self.load.enc = y[0, :]
-        self.load.lzrr = y[2, :].copy()
-        self.load.lzr = y[2, :].copy()
+        self.load.lzrr = y[2, :]
+        self.load.lzr = y[2, :]
         if filt:
-            print('Filtering Laser')
+            log.debug('Filtering Laser')
             self.load.lzr = filt(lzr)
         # filters
         # lzr = signal.medfilt(lzr, 21)
@@ -149,7 +201,9 @@ class ExfoJobj(object):
         self.load.enc = enc
         # self.load.lzr = lzr
 
-    def Load_Batch(self, directory, trim=False, filt=None, llim=26, ulim=74):
+    @Instrument.timer('Load_Batch')
+    @StageCache.stage(inputs=(_batch_sources,), outputs=_scan_attrs, ignore=('workers',))
+    def Load_Batch(self, directory, trim=False, filt=None, llim=26, ulim=74, workers=None):
         """
         Load a batch of scan data thats describes one exfoliation
 
@@ -161,114 +215,203 @@ class ExfoJobj(object):
             Specify which scans to skip. The default is False.
         filt : Function, optional
             filtering function lzr = filt(lzr)
+        workers : int, optional
+            Load the scans in a pool of this many processes. filt has to be
+            an int or picklable. The default is None, load one after another.
 
         Returns
         -------
         None.
         """
 
-        if type(filt) is int:
-            filt = exFilter(filt)
+        names = sorted(set([Path(d.stem).stem for d in [*Path(directory).iterdir()]]))
+        args = [(directory, n, trim, filt, llim, ulim) for n in names]
+        if workers:
+            with ProcessPoolExecutor(workers) as pool:
+                results = [*pool.map(_load_batch_scan, *zip(*args), [True]*len(args))]
+        else:
+            results = [_load_batch_scan(*a) for a in args]
+
+        # records of worker processes are logged in file order
+        loaded = 0
+        for scan, obj, records in results:
+            Instrument.replay(records)
+            if obj is not None:
+                setattr(self, scan, obj)
+                loaded += 1
+        Instrument.event('batch', 'Loaded {} of {} scans from {}'.format(
+            loaded, len(names), directory), directory=str(directory), scans=loaded)
+
+    @Instrument.timer('Get_Stress')
+    @StageCache.stage(inputs=('sync_stress', 'sync_stress_x', 'ni',
+                              lambda self, p: self._stress_sem() if p['sem'] else None),
+                      outputs=('S', 'R', 'S_sem', 'R_sem'))
+    def Get_Stress(self, win=50, wafer_thickness=580E-6, filt=None, sem=False,
+                   thick_film=False):
+        """
+        Ni film stress from the curvature of the stress scan.
 
-        names = set([Path(d.stem).stem for d in [*Path(directory).iterdir()]])
-        for n in names:
-            filepath = directory
-            if Path(directory).joinpath(n).with_suffix('.trim.dat').exists():
-                file = Path(n).with_suffix('.trim.dat')
-            elif Path(directory).joinpath(n).with_suffix('.dat').exists():
-                file = Path(n).with_suffix('.dat')
-            elif Path(directory).joinpath(n).with_suffix('.tdms').exists():
-                file = Path(n).with_suffix('.tdms')
-                print(file)
-                self.Load_Scan(filepath, file, trim, scan=False, filt=None, llim=llim, ulim=ulim)
-                scan = self.scans.get(Path(file).name[0], 'base')
-                getattr(self, scan).Pickle_TDMS(directory, file)
-            else:
-                print('load error')
-                print(n)
-                continue
-            self.Load_Scan(filepath, file, trim, scan=False, filt=filt, llim=llim, ulim=ulim)
+        The radius of curvature R(x) comes from quadratic fits over a window
+        of win mm around each position (local_curvature). A window longer
+        than the profile is one quadratic over all of it.
 
-    def Get_Stress(self, win=50, wafer_thickness=580E-6, filt=None):
+        Parameters
+        ----------
+        win : float, optional
+            fit window (mm). The default is 50, the whole profile.
+        wafer_thickness : float, optional
+            Si wafer thickness (m). The default is 580E-6.
+        filt : Filter or int, optional
+            filter of ni, an int is sFilter(self, filt). The default is None.
+        sem : bool, optional
+            also propagate the stress and Ni scans' SEM to self.R_sem and
+            self.S_sem, the one sigma band of R and S. The default is False.
+        thick_film : bool, optional
+            add the film's own bending term (2*ni*ENi)/(3*R*(1-nuNi)) to
+            Stoney's equation. The default is False.
 
+        Returns
+        -------
+        None.
+        """
         if type(filt) is int:
             filt = sFilter(self, filt)
 
-        MSi = 1.803E11
-        ENi = 180E9
-        nuNi = .31
-        # wafer_thickness = 500E-6
-        # s = filt(self.sync_stress)
-        z = np.polyfit(self.sync_stress_x, self.sync_stress, 2)
-        p = np.poly1d(z)
-        # s = p(self.sync_stress_x)
-        dp = np.polyder(p)
-        ds = dp(self.sync_stress_x)
-        ddp = np.polyder(p, 2)
-        dds = ddp(self.sync_stress_x)
-        R = abs(((1+ds**2)**1.5)/dds)
-        # mask = np.isnan(R)
-        # R[mask] = np.interp(np.flatnonzero(mask), np.flatnonzero(~mask), R[~mask])
+        sems = self._stress_sem() if sem else None
+        R, R_sem = local_curvature(self.sync_stress_x, self.sync_stress, win,
+                                   None if sems is None else sems[0])
         ni = self.ni
         if filt:
             # R = filt(R)
             ni = filt(self.ni)
         # Convert to meters
         R = R*1E-3
-        self.S = (MSi*wafer_thickness**2)/(6*ni*R)
-        +(2*ni*ENi)/(3*R*(1-nuNi))
+        self.S = stoney(R, ni, wafer_thickness, thick_film)
         self.R = R
-
-    def Wafer_Sync(self, d='f', resamp=False):
+        self.R_sem = self.S_sem = None
+        if sem:
+            # first order, the Ni SEM is taken before any filtering
+            self.R_sem = R_sem*1E-3
+            self.S_sem = abs(self.S)*np.sqrt((self.R_sem/R)**2 + (sems[1]/ni)**2)
+
+    def _sync_sem(self, scan):
+        """SEM of sync_<scan>, its row of the sync matrix."""
+        return self.sync_sem[self.sync_names.index(scan+'_'+self.sync_d), self.sync_cols]
+
+    def _stress_sem(self):
+        """SEM of sync_stress (mm) and of ni (m), from the sync matrix."""
+        return self._sync_sem('stress'), np.hypot(self._sync_sem('nickel'),
+                                                  self._sync_sem('base'))*1E-3
+
+    @Instrument.timer('Wafer_Sync')
+    @StageCache.stage(inputs=('grid.scale', _sync_means), outputs=_sync_attrs)
+    def Wafer_Sync(self, d='f', resamp=False, max_lag=.5):
         """
         Take scan means and sync them togther to process as a wafer
 
+        The forward and backward means of every loaded scan become the rows
+        of one (scans x grid) matrix on a shared encoder grid, self.sync,
+        with their SEM in self.sync_sem and where each row has data in
+        self.sync_mask. Rows are named '<scan>_<f or b>' in self.sync_names.
+        sync_<scan> and sync_<scan>_x are the d rows over the positions all
+        d rows cover (self.sync_cols), views of the matrix where those are
+        contiguous.
+
+        With d='fb' both directions are used: each scan's lag and offset of
+        backward to forward are estimated and split between them, then the
+        corrected rows are merged weighted by 1/SEM**2 into '<scan>_fb'
+        rows (fb_fuse). The lags (mm) and offsets are kept in self.sync_lag
+        and self.sync_offset.
+
         Parameters
         ----------
         d : string, optional
-            specify scan direction forward 'f' or backward 'b'. The default is 'f'.
+            specify scan direction forward 'f', backward 'b' or both fused
+            'fb'. The default is 'f'.
+        resamp : tuple, optional
+            (llim, ulim) grid the means are interpolated onto, for sparse
+            encoders. The default is False, the encoder bins the scans have.
+        max_lag : float, optional
+            largest backward lag searched with d='fb' (mm). The default is .5.
+
+        Raises
+        ------
+        ValueError
+            When the scans have no position in common.
 
         Returns
         -------
         None.
         """
-
-        scans = [scan for scan in self.scans.values() if getattr(self, scan, False)]
-        if 'load' in scans:
-            scans.remove('load')
+        if d not in ('f', 'b', 'fb'):
+            raise ValueError("scan direction d should be 'f', 'b' or 'fb'")
+        scans = _synced_scans(self)
+        names = [scan+'_'+fb for scan in scans for fb in 'fb']
+        means = [getattr(getattr(self, scan), fb+'means') for scan in scans for fb in 'fb']
+        n = len(means)
 
         if resamp:
-            X = np.arange(resamp[0], resamp[1], .01)
-            for scan in scans:
-                m = [*getattr(getattr(self, scan), d+'means')]
-                x = m[4]
-                y = m[0]
-                Y = np.interp(X, x, y)
-                m[0] = Y
-                m[4] = X
-
-                setattr(getattr(self, scan), d+'means', m)
-
-        trim_min = max([getattr(getattr(self, scan), d+'means')[4].min() for scan in scans])
-        trim_max = min([getattr(getattr(self, scan), d+'means')[4].max() for scan in scans])
-
-        idx_min = []
-        idx_max = []
-        for scan in scans:
-            scan_x = getattr(getattr(self, scan), d+'means')[4]
-            idx_min.append(np.where(scan_x == trim_min)[0][0])
-            idx_max.append(np.where(scan_x == trim_max)[0][0])
-
-        x_len = min(idx_max)-max(idx_min)
-
+            bins = self.grid.arange(*resamp)
+            xs = [m[4] for m in means]
+            values, mask = stack_interp(self.grid.x(bins), xs + xs,
+                                        [m[0] for m in means] + [m[3] for m in means])
+            sync, sem, mask = values[:n], values[n:], mask[:n]
+        else:
+            # every row's bins scattered into the matrix at once
+            rows = [self.grid.bins(m[4]) for m in means]
+            lo = min(r.min() for r in rows)
+            bins = np.arange(lo, max(r.max() for r in rows) + 1)
+            r = np.repeat(np.arange(n), [row.shape[0] for row in rows])
+            c = np.concatenate(rows) - lo
+            sync = np.full((n, bins.shape[0]), np.nan)
+            sem = np.full((n, bins.shape[0]), np.nan)
+            mask = np.zeros((n, bins.shape[0]), dtype=bool)
+            sync[r, c] = np.concatenate([m[0] for m in means])
+            sem[r, c] = np.concatenate([m[3] for m in means])
+            mask[r, c] = True
+
+        grid = self.grid.x(bins)
+        self.sync_lag = self.sync_offset = None
+        if d == 'fb':
+            # rows gap free over their span, then fused per scan
+            x = [grid[m] for m in mask]
+            filled, _ = stack_interp(grid, x + x, [*(v[m] for v, m in zip(sync, mask)),
+                                                   *(e[m] for e, m in zip(sem, mask))])
+            f, b = filled[0:n:2], filled[1:n:2]
+            fsem, bsem = filled[n::2], filled[n+1::2]
+            fused, fused_sem, self.sync_lag, self.sync_offset = fb_fuse(
+                grid, f, b, fsem, bsem, max_lag)
+            Instrument.event('fb_fuse', 'F-B lag {} mm, offset {} mm'.format(
+                np.round(self.sync_lag, 4), np.round(self.sync_offset, 5)), logging.DEBUG,
+                scans=scans, lag=self.sync_lag.tolist(), offset=self.sync_offset.tolist())
+            names = names + [scan+'_fb' for scan in scans]
+            sync = np.vstack((sync, fused))
+            sem = np.vstack((sem, fused_sem))
+            mask = np.vstack((mask, ~np.isnan(fused)))
+
+        use = [i for i, name in enumerate(names) if name.rsplit('_', 1)[1] == d]
+        cols = np.flatnonzero(mask[use].all(axis=0))
+        if cols.size == 0:
+            raise ValueError('scans have no encoder positions in common')
+        if cols[-1] - cols[0] + 1 == cols.size:
+            cols = slice(int(cols[0]), int(cols[-1]) + 1)
+
+        self.sync = sync
+        self.sync_sem = sem
+        self.sync_mask = mask
+        self.sync_grid = grid
+        self.sync_names = names
+        self.sync_cols = cols
+        self.sync_d = d
         for scan in scans:
-            scan_mean = getattr(getattr(self, scan), d+'means')[0]
-            scan_x = getattr(getattr(self, scan), d+'means')[4]
-            x_min = np.where(scan_x == trim_min)[0][0]
-            setattr(self, 'sync_'+scan, scan_mean[x_min:x_min+x_len])
-            setattr(self, 'sync_'+scan+'_x', scan_x[x_min:x_min+x_len])
+            setattr(self, 'sync_'+scan, sync[names.index(scan+'_'+d), cols])
+            setattr(self, 'sync_'+scan+'_x', self.sync_grid[cols])
 
         # need to add scaling if enc is not uniform
+    @Instrument.timer('Wafer_Make')
+    @StageCache.stage(inputs=('sync_base', 'sync_base_x', 'sync_nickel', 'sync_exfo',
+                              _load_enc0),
+                      outputs=('x', 'w', 'ni', 'ex', 'load'))
     def Wafer_Make(self, w=.545, wo=.017, glass=1.8631, k=.101, filt=None):
 
         if type(filt) is int:
@@ -289,23 +432,55 @@ class ExfoJobj(object):
         if filt:
             self.ni = filt(self.ni)
         if hasattr(self, 'load'):
-            self.load.enc = self.load.enc-self.x[0]
+            # shifted copy, the loaded scan keeps its encoder so this can be rerun
+            load = copy.copy(self.load)
+            load.enc0 = getattr(self.load, 'enc0', self.load.enc)
+            load.enc = load.enc0-self.x[0]
+            self.load = load
         self.x = self.x-self.x[0]
 
     def Pickle_Wafer(self, filepath, file):
         """Pickle the wafer data so it can be loaded faster."""
-        print('Pickling ', Path(file).name)
+        log.info('Pickling %s', Path(file).name)
         pickle.dump([self.x, self.w, self.ni, self.ex, self.S, self.Load, self.load], open(
             Path(filepath).joinpath(file).with_suffix(".dat"), 'wb'))
 
     def Load_Wafer(self, filepath, file):
         [self.x, self.w, self.ni, self.ex, self.S, self.Load, self.load] = pickle.load(
             open(Path(Path(filepath).joinpath(file)).with_suffix(".dat"), 'rb'))
-        print('Loading ', Path(file).name)
+        log.info('Loading %s', Path(file).name)
 
-    def Make_Meta(self, file, i=2):
+    @Instrument.timer('Make_Meta')
+    def Make_Meta(self, file, i=2, mode='exact', n_inducing=500, holdout=.2, exact_max=2000,
+                  cache=None):
         """
+        Train the metamodel on an ANSYS sweep.
+
         i: 0-Ni (um),1-Si (um), 2-T (N), 3-S (MPa),4-a (um), 5-h (um), 6-K2, 7-K1
+
+        Parameters
+        ----------
+        file : String
+            ANSYS sweep csv
+        i : int, optional
+            output column. The default is 2.
+        mode : String, optional
+            'exact' GPR on all rows, or 'sparse' inducing point GPR for sweeps
+            too large for the exact one. The default is 'exact'.
+        n_inducing : int, optional
+            sparse mode inducing points. The default is 500.
+        holdout : float, optional
+            sparse mode fraction of rows held out to compare against an exact
+            GPR, 0 to train on all rows. The default is .2.
+        exact_max : int, optional
+            rows the exact GPR used for the comparison is trained on. The default is 2000.
+        cache : Path or MetaModel.MetaCache, optional
+            metamodel store. A model trained before from the same csv
+            contents, column and settings is read from it instead of
+            retrained. The default is None.
+
+        Models are kept per output column in self.metas, a repeated call
+        for a column returns at once; Use_Meta switches between them.
         """
         from sklearn.gaussian_process import GaussianProcessRegressor
         from sklearn.gaussian_process.kernels import DotProduct
@@ -314,27 +489,139 @@ class ExfoJobj(object):
 
         kernel = C(.1, (0.01, 10.0)) * (DotProduct(sigma_0=7.74, sigma_0_bounds=(0.01, 10.0)) ** 2)
 
+        params = {'mode': mode, 'kernel': repr(kernel),
+                  'bounds': [[h.name, h.bounds.tolist()] for h in kernel.hyperparameters]}
+        if mode == 'sparse':
+            params.update(n_inducing=n_inducing, holdout=holdout, exact_max=exact_max)
+        key = MetaModel.MetaCache.key(file, i, **params)
+        if not hasattr(self, 'metas'):
+            self.metas = {}
+        if i in self.metas and self.metas[i]['key'] == key:
+            self.Use_Meta(i)
+            return
+        if cache is not None and not isinstance(cache, MetaModel.MetaCache):
+            cache = MetaModel.MetaCache(cache)
+        model = cache.get(key) if cache is not None else None
+        if model is not None:
+            log.info('Loading cached meta %s', key[:12])
+            self.metas[i] = {'key': key, 'model': model}
+            self.Use_Meta(i)
+            return
+
         adat = np.genfromtxt(file, delimiter=",")[1:, :]
         X = np.concatenate((adat[:, :i], adat[:, i+1:]), 1)
-        self.scalerX = preprocessing.StandardScaler().fit(X)
         y = np.expand_dims(adat[:, i], 1)
-        self.scalery = preprocessing.StandardScaler().fit(y)
 
-        self.gpr = GaussianProcessRegressor(
-            kernel=kernel, random_state=0, n_restarts_optimizer=0, alpha=.001).fit(
-                self.scalerX.transform(X), self.scalery.transform(y))
+        if mode == 'exact':
+            self.scalerX = preprocessing.StandardScaler().fit(X)
+            self.scalery = preprocessing.StandardScaler().fit(y)
+            self.gpr = GaussianProcessRegressor(
+                kernel=kernel, random_state=0, n_restarts_optimizer=0, alpha=.001).fit(
+                    self.scalerX.transform(X), self.scalery.transform(y))
+        elif mode == 'sparse':
+            order = np.random.default_rng(0).permutation(X.shape[0])
+            test = order[:int(holdout*X.shape[0])]
+            train = order[test.shape[0]:]
+            self.scalerX = preprocessing.StandardScaler().fit(X[train])
+            self.scalery = preprocessing.StandardScaler().fit(y[train])
+            Xs = self.scalerX.transform(X)
+            ys = self.scalery.transform(y)
+            self.gpr = MetaModel.SparseGPR(kernel, alpha=.001, n_inducing=n_inducing).fit(
+                Xs[train], ys[train])
+            if test.shape[0]:
+                exact = GaussianProcessRegressor(
+                    kernel=kernel, random_state=0, n_restarts_optimizer=0, alpha=.001).fit(
+                        Xs[train[:exact_max]], ys[train[:exact_max]])
+                ps = self.scalery.inverse_transform(self.gpr.predict(Xs[test]).reshape(-1, 1))
+                pe = self.scalery.inverse_transform(exact.predict(Xs[test]).reshape(-1, 1))
+                self.meta_report = {
+                    'rows': X.shape[0], 'held_out': test.shape[0],
+                    'sparse_rmse': np.sqrt(np.mean((ps-y[test])**2)),
+                    'exact_rmse': np.sqrt(np.mean((pe-y[test])**2)),
+                    'sparse_vs_exact_rmse': np.sqrt(np.mean((ps-pe)**2))}
+                Instrument.event('meta_report', 'Held out RMSE sparse {sparse_rmse:.4g}, '
+                                 'exact {exact_rmse:.4g}, sparse vs exact '
+                                 '{sparse_vs_exact_rmse:.4g}'.format(**self.meta_report),
+                                 **self.meta_report)
+        else:
+            raise ValueError('mode must be exact or sparse')
+        self.meta = None
+        self.metas[i] = {'key': key, 'model': [self.scalerX, self.scalery, self.gpr]}
+        if cache is not None:
+            cache.put(key, self.metas[i]['model'], file=Path(file).name, i=i, **params)
+
+    def Use_Meta(self, i):
+        """Switch Make_Load/Meta to the model Make_Meta trained for output column i."""
+        self.scalerX, self.scalery, self.gpr = self.metas[i]['model']
+        self.meta = None
 
     def Pickle_Meta(self, filepath, file):
         """Pickle the meta so it can be loaded faster."""
-        print('Pickling ', Path(file).name)
+        log.info('Pickling %s', Path(file).name)
         pickle.dump([self.scalerX, self.scalery, self.gpr], open(
             Path(filepath).joinpath(file).with_suffix(".dat"), 'wb'))
 
     def Load_Meta(self, filepath, file):
         [self.scalerX, self.scalery, self.gpr] = pickle.load(
             open(Path(Path(filepath).joinpath(file)).with_suffix(".dat"), 'rb'))
-        print('Loading ', Path(file).name)
+        self.meta = None
+        log.info('Loading %s', Path(file).name)
 
+    def Export_Meta(self, filepath, file):
+        """Save the closed form quadratic of the GPR metamodel (.npz)."""
+        log.info('Exporting %s', Path(file).name)
+        MetaModel.QuadMeta.from_gpr(self.gpr, self.scalerX, self.scalery).save(
+            Path(filepath).joinpath(file).with_suffix(".npz"))
+
+    def Import_Meta(self, filepath, file):
+        """Use a quadratic metamodel saved by Export_Meta for Make_Load."""
+        self.meta = MetaModel.QuadMeta.load(Path(filepath).joinpath(file).with_suffix(".npz"))
+        log.info('Loading %s', Path(file).name)
+
+    def Meta(self):
+        """
+        Prediction engine for the current metamodel.
+
+        The quadratic metamodel from Import_Meta if one was imported,
+        otherwise the GPR, rebuilt when Make_Meta or Load_Meta replace it.
+
+        Returns
+        -------
+        MetaModel.GPRInference or MetaModel.QuadMeta
+        """
+        if getattr(self, 'meta', None) is not None:
+            return self.meta
+        infer = getattr(self, '_infer', None)
+        if infer is None or infer.gpr is not self.gpr:
+            infer = MetaModel.GPRInference(self.gpr, self.scalerX, self.scalery)
+            self._infer = infer
+        return infer
+
+    def Load_Inputs(self, ex=8, a=1500, h=150, k2=0, k1=730, filt=None, ni=None, S=None):
+        """
+        Metamodel inputs (N x 7) for the current wafer, see Make_Load.
+
+        ni and S default to the wafer's, stacks of them (K x N) give
+        (K x N x 7) inputs.
+        """
+        if type(filt) is int:
+            filt = nFilter(self, filt)
+
+        ni = self.ni if ni is None else ni
+        S = self.S if S is None else S
+        const = np.array([0, ex, 0, a, h, k2, k1])
+        C = np.ones(np.shape(ni) + (7,))*const
+
+        if filt:
+            ni = filt(ni) if np.ndim(ni) == 1 else Filters.batch(filt, ni)
+        Xtest = C
+        Xtest[..., 0] = ni*1E6
+        Xtest[..., 2] = S*1E-6
+        return Xtest
+
+    @Instrument.timer('Make_Load')
+    @StageCache.stage(inputs=('ni', 'S', 'sync_stress_x', lambda self, p: self.Meta()),
+                      outputs=('Load',))
     def Make_Load(self, ex=8, a=1500, h=150, k2=0, k1=730, filt=None, floor=5):
         """
         Make compensated Load profile
@@ -357,39 +644,143 @@ class ExfoJobj(object):
         None.
         """
 
-        if type(filt) is int:
-            filt = nFilter(self, filt)
-
-        const = np.array([0, ex, 0, a, h, k2, k1])
-        C = np.ones((self.ni.shape[0], 7))*const
-
-        ni = self.ni
-        if filt:
-            ni = filt(self.ni)
-        Xtest = C
-        Xtest[:, 0] = ni*1E6
-        Xtest[:, 2] = self.S*1E-6
+        Xtest = self.Load_Inputs(ex=ex, a=a, h=h, k2=k2, k1=k1, filt=filt)
 
         # Compute load with scaling
-        self.Load = self.scalery.inverse_transform(self.gpr.predict(self.scalerX.transform(Xtest)))
+        self.Load = self.Meta().predict(Xtest)
         if floor:
             self.Load[self.Load < floor] = floor
 
-    def Export_Load(self, filepath, file, wafer_points=3000, ramp=False, window=False):
-        # Interp load to fit export
-        Load = np.interp(np.linspace(0, len(self.Load)-1, wafer_points),
-                         np.arange(0, len(self.Load)), np.squeeze(self.Load))
-        # Convert to N?
-        Load = Load/9.81
-        if window:
-            pad = np.ones(int((window-wafer_points)/2))
-            Load = np.concatenate((pad*Load[0], Load, pad*Load[-1]))
-        if ramp:
-            Load = np.concatenate((np.linspace(0, Load[0], ramp), Load.flatten()))
-        np.savetxt(Path(Path(filepath).joinpath(file)).with_suffix(".csv"),
-                   Load, delimiter=',')
+    def Sweep_Load(self, ex=8, a=1500, h=150, k2=0, k1=730, filt=None, floor=5):
+        """
+        Make Load profiles for a grid of targets in one call.
+
+        Takes the same parameters as Make_Load, any of ex, a, h, k2 and k1
+        can be arrays; they are broadcast against each other.
+
+        Returns
+        -------
+        Load : np.array
+            (targets x N) Load profiles, in the broadcast order of the parameters
+        """
+        params = np.broadcast_arrays(*[np.asarray(v, dtype=float) for v in (ex, a, h, k2, k1)])
+        values = np.stack([p.ravel() for p in params], 1)
+        Xtest = self.Load_Inputs(filt=filt)
+        Load = self.Meta().sweep(Xtest, [1, 3, 4, 5, 6], values)
+        if floor:
+            Load[Load < floor] = floor
+        return Load.reshape(params[0].shape + (Xtest.shape[0],))
+
+    @Instrument.timer('Propagate_Load')
+    def Propagate_Load(self, K=200, wafer=None, stress=None, load=None, level=.95, seed=None):
+        """
+        Monte Carlo Load uncertainty from the SEM of the synced scans.
+
+        K copies of sync_base, sync_nickel and sync_stress are drawn with
+        their per position SEM (Wafer_Sync's sync_sem) as independent normal
+        noise, and all of them go through the Wafer_Make, Get_Stress and
+        Make_Load steps as (K x N) stacks, the metamodel in one predict
+        call on K*N rows.
+
+        Parameters
+        ----------
+        K : int, optional
+            number of draws. The default is 200.
+        wafer, stress, load : dict, optional
+            Wafer_Make, Get_Stress and Make_Load parameters, use the ones the
+            wafer was made with. The defaults are those of the methods.
+        level : float, optional
+            confidence level of the band. The default is .95.
+        seed : int, optional
+            random seed. The default is None.
+
+        Returns
+        -------
+        Load_mean : np.array
+            (N) mean Load over the draws
+        Load_band : np.array
+            (2 x N) lower and upper bound of the level band
+
+        Also sets self.Load_std, the spread of the draws, and
+        self.Load_gp_std, the GPR's predictive std at the wafer's own inputs
+        (None for a quadratic metamodel, which has no std).
+        """
+        wafer = {**_defaults(self.Wafer_Make), **(wafer or {})}
+        stress = {**_defaults(self.Get_Stress), **(stress or {})}
+        load = {**_defaults(self.Make_Load), **(load or {})}
+        rng = np.random.default_rng(seed)
+
+        def draw(scan):
+            sem = np.nan_to_num(self._sync_sem(scan))
+            return getattr(self, 'sync_'+scan) + rng.standard_normal((K, sem.shape[0]))*sem
+
+        # Wafer_Make
+        w = wafer['glass']+wafer['w']+wafer['k']-wafer['wo']
+        ni = (draw('nickel')-(draw('base')-w))*1E-3
+        filt = wafer['filt']
+        if filt:
+            ni = Filters.batch(wFilter(filt) if type(filt) is int else filt, ni)
+        # Get_Stress
+        R = local_curvature(self.sync_stress_x, draw('stress'), stress['win'])[0]*1E-3
+        filt = stress['filt']
+        nis = ni
+        if filt:
+            nis = Filters.batch(sFilter(self, filt) if type(filt) is int else filt, ni)
+        S = stoney(R, nis, stress['wafer_thickness'], stress['thick_film'])
+        # Make_Load
+        args = {k: load[k] for k in ('ex', 'a', 'h', 'k2', 'k1', 'filt')}
+        X = self.Load_Inputs(ni=ni, S=S, **args)
+        meta = self.Meta()
+        Load = meta.predict(X.reshape(-1, 7))[:, 0].reshape(K, -1)
+        if load['floor']:
+            Load[Load < load['floor']] = load['floor']
+
+        self.Load_mean = Load.mean(0)
+        self.Load_std = Load.std(0)
+        self.Load_band = np.quantile(Load, [(1-level)/2, (1+level)/2], axis=0)
+        self.Load_gp_std = None
+        if isinstance(meta, MetaModel.GPRInference):
+            self.Load_gp_std = meta.predict(self.Load_Inputs(**args), return_std=True)[1][:, 0]
+        Instrument.event('propagate', 'Load std {:.3g} (draws) {} (GPR) over {} draws'.format(
+            self.Load_std.mean(), 'n/a' if self.Load_gp_std is None else
+            '{:.3g}'.format(self.Load_gp_std.mean()), K), K=K,
+            std=float(self.Load_std.mean()))
+        return self.Load_mean, self.Load_band
+
+    @Instrument.timer('Export_Load')
+    def Export_Load(self, filepath, file, wafer_points=3000, ramp=False, window=False,
+                    fmt='csv', scale=100):
+        """
+        Write the Load profile as controller setpoints (kg), see Export.export.
+
+        Parameters
+        ----------
+        filepath : Path
+        file : String
+            file name, the suffix is set by fmt
+        wafer_points : int or list, optional
+            setpoints over the wafer. The default is 3000.
+        ramp : int, optional
+            setpoints ramping up from 0 first. The default is False.
+        window : int or list, optional
+            setpoints of the whole scan, padded with the end values. The
+            default is False.
+        fmt : String, optional
+            'csv', or binary setpoint tables 'f32', 'u16' or 'i32'. The
+            default is 'csv'.
+        scale : float, optional
+            counts per kg of the fixed point tables. The default is 100.
+
+        Returns
+        -------
+        list
+            (path, stamp) of each file written, one per wafer size and window
+        """
+        return Export.export(Path(filepath).joinpath(file), np.squeeze(self.Load), wafer_points,
+                             ramp, window, fmt, scale, meta={'wafer': self.name})
 
     def Load_exLoad(self, filepath, file, trim=False, filt=None):
+        from nptdms import TdmsFile
         tdms_file = TdmsFile(Path(Path(filepath).joinpath(file)).with_suffix(".tdms"))
         group = tdms_file['Untitled']
         channel1 = group['encoder']
@@ -405,6 +796,7 @@ class ExfoJobj(object):
         self.exLoad = Scan(time, enc, load, trim=trim, filt=filt)
 
     def Load_exLoadalt(self, filepath, file):
+        from nptdms import TdmsFile
         tdms_file = TdmsFile(Path(Path(filepath).joinpath(file)).with_suffix(".tdms"))
         group = tdms_file['Untitled']
         channel1 = group['encoder']
@@ -415,51 +807,62 @@ class ExfoJobj(object):
         # %% plot zone
 
     def Plot_Wafer(self):
-
-        color = plt.rcParams['axes.prop_cycle'].by_key()['color'][0]
-        fig, ax1 = plt.subplots(figsize=(8, 4))
-        ax1.plot(self.x, self.ni*1E6, color=color, linestyle='--', label='Ni Thickness')
-        if hasattr(self, 'ex'):
-            ax1.plot(self.x, self.ex*1E6, color=color, linestyle='-', label='Si Thickness')
-        ax1.tick_params(axis='y', labelcolor=color)
-        # ax1.set_title('Wafer Profile')
-        ax1.set_xlabel('Chuck (mm)')
-        ax1.set_ylabel('Si and Ni Film Thickness (µm)', color=color)
-
-        color = plt.rcParams['axes.prop_cycle'].by_key()['color'][1]
-        ax2 = ax1.twinx()
-        ax2.plot(self.x, self.S/1E8, color=color, linestyle='-.', label='Ni Stress')
-        ax2.plot(self.x, self.Load/9.81, color=color, linestyle='-', label='Handle Tension')
-        if hasattr(self, 'load'):
-            x, _, y = syncstuff(self.x, self.Load, self.load.enc, self.load.lod, dm=False)
-            ax2.plot(x, y, color=color, linestyle=':', label='Measured Tension')
-        ax2.tick_params(axis='y', labelcolor=color)
-        ax2.set_ylabel(r'Ni Stress (Pa$\cdot 10^8$) and Handle Tension (Kg)', color=color)
-        # lines, labels = ax1.get_legend_handles_labels()
-        # lines2, labels2 = ax2.get_legend_handles_labels()
-        # ax2.legend(lines + lines2, labels + labels2, loc=0)
-        fig.legend(bbox_to_anchor=(0.03, 0.5, .93, 0.5), loc='upper left', ncol=5, mode="expand", borderaxespad=0., handletextpad=0.1)
-
-        fig.tight_layout(pad=0.1)
-        # ax1.set_xlim(left=0, right=25)
-        ax1.margins(x=0)
-        ax1.set_title('')
-        ax1.set_xlabel('Distance from Stable Crack Start (mm)')
-        return fig, ax1, ax2
+        """Plot the wafer profile, see Plots.plot_wafer."""
+        import Plots
+        return Plots.plot_wafer(self)
 
     def Plot_Batch(self):
-        scans = [scan for scan in self.scans.values() if getattr(self, scan, False)]
-        [(getattr(self, scan).plot_check(), plt.suptitle(scan)) for scan in scans]
-        [(getattr(self, scan).plot_scans_sub(), plt.suptitle(scan)) for scan in scans]
+        """Plot every loaded scan, see Plots.plot_batch."""
+        import Plots
+        return Plots.plot_batch(self)
 
 
 # %%
+def _load_batch_scan(directory, n, trim, filt, llim, ulim, capture=False):
+    """
+    Cache and load one scan of a batch.
+
+    Module level so Load_Batch can run it in worker processes. With capture
+    the log records are returned instead of emitted.
+
+    Returns
+    -------
+    scan : String
+        scan attribute name
+    obj : Scan
+        loaded scan or None on a load error
+    records : list
+        captured log records
+    """
+    records = []
+    with Instrument.capture() if capture else contextlib.nullcontext(records) as records:
+        if type(filt) is int:
+            filt = exFilter(filt)
+        Ex = ExfoJobj(n)
+        scan = Ex.scans.get(n[0], 'base')
+        cache = ScanCache.cache_path(directory, n)
+        for suffix in ('.trim.dat', '.dat', '.tdms'):
+            source = Path(directory).joinpath(n + suffix)
+            if source.exists():
+                break
+        else:
+            if ScanCache.read_header(cache) is None:
+                Instrument.event('load_error', 'load error {}'.format(n), logging.WARNING,
+                                 scan=n)
+                return scan, None, records
+            source = None
+        if source and not ScanCache.is_fresh(cache, source):
+            log.info('Caching %s', source.name)
+            ScanCache.build(cache, source, scan)
+        Ex.Load_Scan(directory, cache.name, trim, scan=False, filt=filt, llim=llim, ulim=ulim)
+    return scan, getattr(Ex, scan), records
 
 
+# %%
 class Scan(object):
     """Object to stor LabView scans."""
 
-    def __init__(self, time, enc, lzr, llim=41, ulim=65, trim=False, filt=None):
+    def __init__(self, time, enc, lzr, llim=41, ulim=65, trim=False, filt=None, grid=None):
         """
         Init.
 
@@ -477,6 +880,8 @@ class Scan(object):
             Upper scan cutoff in mm. The default is 80.
         trim : array or slice, optional
             Specify which scans to skip. The default is False.
+        grid : EncGrid, optional
+            Encoder grid positions are binned on. The default is 10um bins.
 
         Raises
         ------
@@ -488,22 +893,23 @@ class Scan(object):
         # convert to mm, but leave enc at lv zero
 
         self.time = time
-        self.encr = enc.copy()
-        enc = signal.medfilt(enc, 21)
+        self.grid = grid if grid is not None else EncGrid()
+        # raw channels are only read, keep views instead of copies
+        self.encr = enc
+        enc = Filters.median(enc, 21)
         enc = enc / 100
         self.enc = enc
-        self.lzrr = lzr.copy()
-        self.lzr = lzr.copy()
-        # if filt:
-        #     print('Filtering Laser')
-        #     self.lzr = filt(lzr)
+        self.lzrr = lzr
+        self.lzr = lzr
         # filters
         # lzr = signal.medfilt(lzr, 21)
         self.trim = trim
 
         self.g = np.gradient(self.enc/self.enc.max())
         if any(*np.where(self.g > .005)):
-            print('JUMPS AT', np.where(self.g > .005))
+            jumps = np.flatnonzero(self.g > .005)
+            Instrument.event('encoder_jumps', 'JUMPS AT {}'.format(jumps), logging.WARNING,
+                             at=jumps.tolist())
 
         def zero_runs(a):
             """Create an array that is 1 where a is 0, and pad each end with an extra 0."""
@@ -514,17 +920,16 @@ class Scan(object):
             ranges = np.where(absdiff == 1)[0].reshape(-1, 2)
             return ranges
 
-        # Stack data to trim into individual scans
-        tempst = np.stack([self.enc, self.lzr])
         # trim edges of scans
-        tempst[:, ((tempst[0, :] > ulim) | (tempst[0, :] < llim))] = 0
+        inside = np.where((self.enc > ulim) | (self.enc < llim), 0, self.enc)
         # find indices of runs start stop
-        self.idx = zero_runs(tempst[0, :])
-        print('Loaded ', self.idx.shape[0] / 2, ' scans')
+        self.idx = zero_runs(inside)
+        Instrument.event('scan', 'Loaded {} scans'.format(self.idx.shape[0] / 2),
+                         samples=self.enc.shape[0], passes=self.idx.shape[0])
 
         if np.asarray(trim).any():
             self.idx = np.delete(self.idx, trim, 0)
-            print(self.idx.shape)
+            log.debug('Kept %d passes', self.idx.shape[0])
 
         if self.idx.size == 0:
             raise ValueError('encoder data is very bad')
@@ -532,97 +937,49 @@ class Scan(object):
         # %% Stack scans
         # find shortest scan and trim others to match. then stack them
         def stack_scans(idx, enc, lzr, fb):
-            minL = min(abs(idx[:, 0]-idx[:, 1])[fb:][::2])
-            estack = np.empty((0, minL))
-            lstack = estack.copy()
-            for ii in idx[fb:][::2, :]:
-                ef = enc[range(*ii.tolist())]
-                if filt:
-                    # print('Filtering Laser')
-                    lf = filt(lzr[range(*ii.tolist())])
-                else:
-                    lf = lzr[range(*ii.tolist())]
-                estack = np.append(estack, np.expand_dims(ef[:minL], axis=0), axis=0)
-                lstack = np.append(lstack, np.expand_dims(lf[:minL], axis=0), axis=0)
+            runs = idx[fb:][::2, :]
+            minL = min(runs[:, 1]-runs[:, 0])
+            # (scans x minL) index into the raw channels, gathered in one go
+            cols = runs[:, :1] + np.arange(minL)
+            estack = enc[cols]
+            if filt:
+                # filter whole scans before trimming so edges match per scan filtering,
+                # all scans in one call on a (scans x longest) stack
+                lengths = runs[:, 1]-runs[:, 0]
+                full = np.minimum(runs[:, :1] + np.arange(lengths.max()), lzr.shape[0]-1)
+                lstack = Filters.batch(filt, lzr[full], lengths)[:, :minL]
+            else:
+                lstack = lzr[cols]
             return [estack, lstack]
 
         self.eforward, self.lforward = stack_scans(self.idx, self.enc, self.lzr, 0)
         self.ebackward, self.lbackward = stack_scans(self.idx, self.enc, self.lzr, 1)
 
-        # %%Calculate measurements per position
-        def lasers_per_enc(ence, lzre):
-            from collections import defaultdict
-            fd = []
-            for ii, jj in zip(ence, lzre):
-                fd.append(dict(zip(ii, jj)))
-
-            p_error = defaultdict(list)
-            # you can list as many input dicts as you want here
-            for d in fd:
-                for key, value in d.items():
-                    p_error[key].append(value)
-            return p_error
-
-        self.flper_enc = lasers_per_enc(self.eforward, self.lforward)
-        self.blper_enc = lasers_per_enc(self.ebackward, self.lbackward)
-
-        # %% Calculate errors relative to position
-        def err_by_pos(error_dict):
-            x = []
-            for key, value in error_dict.items():
-                value = np.array(value)
-                value = value-value.mean()
-                error_dict.update({key: value})
-                x.append(abs(value).mean())
-            x = np.array(x)
-            x = x[~np.isnan(x)]
-            return x
-
-        self.error_byp_f = err_by_pos(self.flper_enc.copy())
-        self.error_byp_b = err_by_pos(self.blper_enc.copy())
-
-        # %% Get mean scan and std
-        def get_mean(lzr_per_enc):
-            mn = np.array([])
-            std = np.array([])
-            n = np.array([])
-            encm = np.array([])
-            for key, value in lzr_per_enc.items():
-                mn = np.append(mn, np.array(value).mean())
-                std = np.append(std, np.std(value))
-                n = np.append(n, len(value))
-                encm = np.append(encm, key)
-            SEM = std/np.sqrt(n)
-            t = np.vstack((mn, std, n, SEM, encm)).T
-            x = t[t[:, 4].argsort()].T
-            mn, std, n, SEM, encm = [*x]
-            return mn, std, n, SEM, encm
-
-        self.fmeans = get_mean(self.flper_enc)
-        self.bmeans = get_mean(self.blper_enc)
+        # %% Calculate measurements, errors, mean and std per position
+        self.fmeans, self.error_byp_f, self.finv = enc_groups(
+            self.eforward, self.lforward, self.grid)
+        self.bmeans, self.error_byp_b, self.binv = enc_groups(
+            self.ebackward, self.lbackward, self.grid)
 
         # %% Get error along scan for each scan
-        def scan_error(estack, lstack, means):
-            [mn, std, n, SEM, encm] = means
-            M = dict(zip(encm, mn))
+        def scan_error(lstack, means, inv):
             # covert to microns
-            scan_err = [1000 * np.array([l-M[e] for e, l in zip(*scan)])
-                        for scan in zip(estack, lstack)]
-            smean, sstd, smed = zip(*[
-                [scan.std(), abs(scan).mean(), np.median(abs(scan))]
-                for scan in scan_err])
+            scan_err = 1000 * (lstack - means[0][inv])
+            smean = scan_err.std(axis=1)
+            sstd = abs(scan_err).mean(axis=1)
+            smed = np.median(abs(scan_err), axis=1)
             return [scan_err, smean, smed, sstd]
 
         [self.fscan_error, self.fsmean, self.fsmed, self.fsstd] = scan_error(
-            self.eforward, self.lforward, self.fmeans)
+            self.lforward, self.fmeans, self.finv)
         [self.bscan_error, self.bsmean, self.bsmed, self.bsstd] = scan_error(
-            self.ebackward, self.lbackward, self.bmeans)
+            self.lbackward, self.bmeans, self.binv)
 
         # %%
 
     def Pickle_TDMS(self, filepath, file, Trim=False):
         """Pickle the TDMS so it can be loaded faster."""
-        print('Pickling ', Path(file).name)
+        log.info('Pickling %s', Path(file).name)
         if Trim is not False:
             pickle.dump([self.time, self.encr, self.lzrr, self.trim], open(
                 Path(filepath).joinpath(file).with_suffix(".trim.dat"), 'wb'))
@@ -635,283 +992,44 @@ class Scan(object):
         # %% plot zone
 
     def plot_check(self):
-        """
-        Plot quick check of enc data vs time to check for jumps and junk.
-
-        Returns
-        -------
-        fig : TYPE
-            DESCRIPTION.
-        ax1 : TYPE
-            DESCRIPTION.
-        ax2 : TYPE
-            DESCRIPTION.
-        """
-        fig, ax1 = plt.subplots()
-        for ii in self.idx:
-            ax1.scatter(self.idx[:, 0], self.enc[self.idx[:, 0]], marker='x')
-        for ii in self.idx:
-            ax1.scatter(self.idx[:, 1]-1, self.enc[self.idx[:, 1]-1], marker='x', color='blue')
-        ax1.plot(self.enc)
-        plt.title('Check Start and Stop')
-        plt.xlabel('time steps')
-        plt.ylabel('encoder distance')
-
-        ax2 = ax1.twinx()
-        c = plt.rcParams['axes.prop_cycle'].by_key()['color'][2]
-        ax2.plot(self.g/self.g.max(), color=c)
-        plt.ylabel('encoder gradient')
-        # check errors
-        fx = np.array(self.idx[1:][::2, :].mean(axis=1), dtype='int')
-        bx = np.array(self.idx[0:][::2, :].mean(axis=1), dtype='int')
-        # median or mean?
-        ax2.plot(fx, self.fsmean)
-        ax2.plot(bx, self.bsmean)
-        return fig, ax1, ax2
+        import Plots
+        return Plots.plot_check(self)
 
     def plot_scans(self):
-        """
-        Plot forwards and backwards scans calculated from idx.
-
-        Returns
-        -------
-        fig2 : TYPE
-            DESCRIPTION.
-        ax2 : TYPE
-            DESCRIPTION.
-        fig3 : TYPE
-            DESCRIPTION.
-        ax3 : TYPE
-            DESCRIPTION.
-
-        """
-        fig2, ax2 = plt.subplots()
-        # grab every other scan from idices
-        # forward
-        for ii in self.idx[0:][::2, :]:
-            ef = self.enc[range(*ii.tolist())]
-            lf = self.lzr[range(*ii.tolist())]
-            ax2.plot(ef, lf)
-        ax2.set_title('Forward Chuck Scans')
-        ax2.set_xlabel('Chuck (mm)')
-        ax2.set_ylabel('Laser Distance (mm)')
-
-        fig3, ax3 = plt.subplots()
-        for ii in self.idx[1:][::2, :]:
-            eb = self.enc[range(*ii.tolist())]
-            lb = self.lzr[range(*ii.tolist())]
-            ax3.plot(eb, lb)
-        ax3.set_title('Backward Chuck Scans')
-        ax3.set_xlabel('Chuck (mm)')
-        ax3.set_ylabel('Laser Distance (mm)')
-        return fig2, ax2, fig3, ax3
+        import Plots
+        return Plots.plot_scans(self)
 
     def plot_scans2(self, trim=np.s_[:]):
-        """
-        Plot forwards and backwards scans.
-
-        Parameters
-        ----------
-        trim : TYPE, optional
-            DESCRIPTION. The default is np.s_[50:-500].
-
-        Returns
-        -------
-        fig2 : TYPE
-            DESCRIPTION.
-        ax2 : TYPE
-            DESCRIPTION.
-        fig3 : TYPE
-            DESCRIPTION.
-        ax3 : TYPE
-            DESCRIPTION.
-
-        """
-        fig2, ax2 = plt.subplots()
-        # grab every other scan from idices using attributes
-        # forward
-        for ii, jj in zip(self.eforward, self.lforward):
-            plt.plot(ii[trim], jj[trim])
-        ax2.set_title('Forward Chuck Scans')
-        ax2.set_xlabel('Chuck (mm)')
-        ax2.set_ylabel('Laser Distance (mm)')
-
-        fig3, ax3 = plt.subplots()
-        for ii, jj in zip(self.ebackward, self.lbackward):
-            plt.plot(ii[trim], jj[trim])
-        ax3.set_title('Backward Chuck Scans')
-        ax3.set_xlabel('Chuck (mm)')
-        ax3.set_ylabel('Laser Distance (mm)')
-        return fig2, ax2, fig3, ax3
+        import Plots
+        return Plots.plot_scans2(self, trim)
 
     def plot_scans_sub(self, trim=np.s_[:]):
-        fig, (ax1, ax2) = plt.subplots(2, 1, sharey=True, sharex=True)
-        for ii, jj in zip(self.eforward, self.lforward):
-            ax1.plot(ii[trim], jj[trim])
-        ax1.set_title('Forward Chuck Scans')
-        ax1.set_xlabel('Chuck (mm)')
-        # ax1.set_ylabel('Laser Distance (mm)')
-
-        for ii, jj in zip(self.ebackward, self.lbackward):
-            ax2.plot(ii[trim], jj[trim])
-        ax2.set_title('Backward Chuck Scans')
-        ax2.set_xlabel('Chuck (mm)')
-        # ax2.set_ylabel('Laser Distance (mm)')
-
-        AxZoom.suplabel(ax1, 'Laser Distance (mm)', labelpad=10)
-        return ax1, ax2, fig
+        import Plots
+        return Plots.plot_scans_sub(self, trim)
 
     def plot_mean(self, trim=np.s_[:]):
-        """
-        Plot the means of F-B scans with 1 std window.
-
-        Parameters
-        ----------
-        trim : TYPE, optional
-            DESCRIPTION. The default is np.s_[50:-500].
-
-        Returns
-        -------
-        fig : TYPE
-            DESCRIPTION.
-        ax : TYPE
-            DESCRIPTION.
-
-        """
-        def mean_plot(means):
-            means = [ii[trim] for ii in means]
-            mn, std, n, SEM, encm = means
-            fig, ax = plt.subplots()
-            # ax.fill_between(x, mn - SEM, mn + SEM, alpha=0.2)
-            ax.fill_between(encm, mn - std, mn + std, alpha=0.2)
-            ax.plot(encm, mn)
-            return fig, ax
-
-        fig, ax = mean_plot(self.fmeans)
-        ax.set_title('Forward Scan Mean')
-        ax.set_xlabel('Chuck (mm)')
-        ax.set_ylabel('Laser Distance (mm)')
-
-        fig2, ax2 = mean_plot(self.bmeans)
-        ax2.set_title('Backward Scan Mean')
-        ax2.set_xlabel('Chuck (mm)')
-        ax2.set_ylabel('Laser Distance (mm)')
+        import Plots
+        return Plots.plot_mean(self, trim)
 
     def plot_mean_sub(self, trim=np.s_[:]):
-        def mean_plot(means, ax):
-            means = [ii[trim] for ii in means]
-            mn, std, n, SEM, encm = means
-            ax.fill_between(encm, mn - std, mn + std, alpha=0.2)
-            ax.plot(encm, mn)
-
-        fig, (ax1, ax2) = plt.subplots(2, 1, sharey=True, sharex=True)
-        mean_plot(self.fmeans, ax1)
-        mean_plot(self.bmeans, ax2)
-        # fig.tight_layout()
-        ax1.set_title('Scan Means')
-        # fig.suptitle('Scan Means')
-        # ax1.set_title('Forward')
-        # ax2.set_title('Backward')
-        AxZoom.suplabel(ax1, 'Laser Distance (mm)', labelpad=10)
-        ax1.set_ylabel('Forward')
-        ax2.set_ylabel('Backward')
-        ax2.set_xlabel('Chuck (mm)')
-        return ax1, ax2, fig
+        import Plots
+        return Plots.plot_mean_sub(self, trim)
 
     def plot_error_byp(self, m=2, bins=50):
-        """
-        Plot histograms of error from mean for each unique encoder position for F-B and combined.
-        Plot error to mean for each unique encoder value.
-
-        Trim outliers for more legible axis.
-
-        Parameters
-        ----------
-        m : int, optional
-            exclude outliers m standard deviations out. The default is 2.
-        bins : int, optional
-            Histogram bins. The default is 500.
-
-        Returns
-        -------
-        ax and fig handles
-            forward, backwards, and combined.
-
-        """
-        def reject_outliers(data, m=m):
-            return data[abs(data - np.mean(data)) < m * np.std(data)]
-
-        fig1, (ax1, ax2) = plt.subplots(2, 1, sharey=True, sharex=True, constrained_layout=True)
-        # fig1.tight_layout()
-        # fig1, ax1 = plt.subplots()
-        ax1.hist(reject_outliers(self.error_byp_f * 1000), bins)
-        ax1.set_title('Forward Height Error by Position')
-        ax1.set_ylabel('Counts')
-        # ax1.set_xlabel('Laser Distance Error (µm)')
-
-        # fig2, ax2 = plt.subplots()
-        ax2.hist(reject_outliers(self.error_byp_b * 1000), bins)
-        ax2.set_title('Backward Height Error by Position')
-        ax2.set_ylabel('Counts')
-        ax2.set_xlabel('Laser Distance Error (µm)')
-
-        fig3, ax3 = plt.subplots()
-        x = np.concatenate((self.error_byp_f, self.error_byp_b)) * 1000
-        ax3.hist(reject_outliers(x[~np.equal(x, 0)]), bins)
-        ax3.set_title('Combined F-B Height Error by Position')
-        ax3.set_ylabel('Counts')
-        ax3.set_xlabel('Laser Distance Error (µm)')
-        return ax1, fig1, ax2, ax3, fig3
+        import Plots
+        return Plots.plot_error_byp(self, m, bins)
 
     def plot_scan_error(self):
-        """Plot median error and std for each scan."""
-        fig, ax = plt.subplots()
-        ax.plot(self.fsmed, label='Forward Median')
-        ax.plot(self.bsmed, label='Backward Median')
-        ax.legend()
-        ax.set_title('Per Scan Error')
-        ax.set_xlabel('Scan')
-        ax.set_ylabel('Laser Median Error (µm)')
-
-        ax2 = ax.twinx()
-        ax2.plot(self.fsstd, label='Forward Std', linestyle='--')
-        ax2.plot(self.bsstd, label='Backward Std', linestyle='--')
-        ax2.set_ylabel('Laser Error Std (µm)')
-        ax2.legend()
-        # fig.legend(loc="upper right", bbox_to_anchor=(1,1), bbox_transform=ax.transAxes)
-        return fig, ax, ax2
+        import Plots
+        return Plots.plot_scan_error(self)
 
     def plot_densities(self):
-        """Plot freq domain stuff."""
-        # plt.csd(mn, mnb, NFFT = 1024, detrend='mean')
-        # plt.csd(mn, mnb, NFFT = 64, Fs = 1, noverlap = 32, pad_to=150, detrend='mean')
-        fig, ax = plt.subplots()
-        ax.csd(self.fmeans[0], self.bmeans[0],
-               NFFT=129, Fs=2, noverlap=12, pad_to=900, detrend='mean')
-        ax.set_xlabel('Normalized Frequency')
-        ax.set_xlabel('Combined F-B Spectral Density')
-        ax.set_title('CSD')
-
-        # plt.set_cmap('inferno')
-        # fig2, ax2 = plt.subplots()
-        # ax2.specgram(self.fmeans[0],
-        #              NFFT=65, Fs=1, noverlap=32, detrend='mean', pad_to=200, mode='magnitude')
-        # t = signal.butter(10, .0005, btype='lowpass', output='sos')
-        # tt = signal.sosfilt(t, self.fmeans[0]-self.fmeans[0].mean())
-        # ttb = signal.sosfilt(t, self.bmeans[0]-self.bmeans[0].mean())
-        # fig3, ax3 = plt.subplots()
-        # plt.plot(tt)
-        # plt.plot(ttb)
-
-    # %%
+        import Plots
+        return Plots.plot_densities(self)
+
     def plot_all(self):
-        """Run all the plots."""
-        self.plot_check()
-        self.plot_scans2()
-        self.plot_error_byp(bins=50)
-        self.plot_mean()
-        self.plot_scan_error()
-        # self.plot_densities()
+        import Plots
+        return Plots.plot_all(self)
 
 
 # %%
@@ -921,64 +1039,392 @@ class Lscan(Scan):
 
 
 # %%
-def syncstuff(x1, y1, x2, y2, dm=False, r=2):
-    if r:
-        x1 = x1.round(2)
-        x2 = x2.round(2)
+class EncGrid(object):
+    """
+    Fixed encoder grid.
 
-    if dm:
-        f = dict(zip(x1, y1-y1.mean()))
-        b = dict(zip(x2, y2-y2.mean()))
+    Positions are handled as integer bins, round(x/res), so grouping,
+    alignment and intersection are exact integer operations.
+
+    Parameters
+    ----------
+    res : float, optional
+        Bin size in mm. The default is .01, the encoder resolution.
+    """
+
+    def __init__(self, res=.01):
+        self.res = res
+        # bins per mm, x = bins/scale gives back enc/100 exactly
+        self.scale = round(1/res)
+
+    def bins(self, x):
+        """Bin index of positions x (mm)."""
+        return np.rint(np.asarray(x)*self.scale).astype(np.int64)
+
+    def x(self, bins):
+        """Position (mm) of bins."""
+        return bins / self.scale
+
+    def arange(self, lo, hi):
+        """Bins from lo up to, not including, hi (mm)."""
+        return np.arange(self.bins(lo), self.bins(hi))
+
+
+def enc_groups(estack, lstack, grid=None):
+    """
+    Group stacked scans by encoder position.
+
+    Each scan contributes one laser value per position (the last one, if the
+    encoder sits on a position for several samples), then mean, std, n, SEM and
+    mean absolute error are reduced per position with bincount.
+
+    Parameters
+    ----------
+    estack : np.array
+        (scans x samples) encoder positions
+    lstack : np.array
+        (scans x samples) laser measurements
+    grid : EncGrid, optional
+        Encoder grid. The default is 10um bins.
+
+    Returns
+    -------
+    means : tuple
+        (mn, std, n, SEM, encm) sorted by encoder position
+    error_byp : np.array
+        mean absolute error from the mean for each position, in order of first
+        appearance
+    inv : np.array
+        (scans x samples) index of each sample's position in encm
+    """
+    if grid is None:
+        grid = EncGrid()
+    bins = grid.bins(estack)
+    b0 = bins.min()
+    pos = (bins - b0).ravel()
+    span = pos.max() + 1
+    order = np.arange(pos.shape[0])
+    # keep last sample of each position in each scan
+    code = np.repeat(np.arange(estack.shape[0]) * span, estack.shape[1]) + pos
+    last = np.full(estack.shape[0] * span, -1)
+    np.maximum.at(last, code, order)
+    keep = last[last >= 0]
+    first = np.full(span, pos.shape[0])
+    np.minimum.at(first, pos, order)
+
+    # compact to the positions that were seen
+    seen = first < pos.shape[0]
+    remap = np.cumsum(seen) - 1
+    npos = remap[-1] + 1
+    k = remap[pos[keep]]
+    v = lstack.ravel()[keep]
+    inv = remap[pos].reshape(estack.shape)
+    encm = grid.x(np.flatnonzero(seen) + b0)
+
+    n = np.bincount(k, minlength=npos).astype(float)
+    mn = np.bincount(k, v, minlength=npos) / n
+    dev = v - mn[k]
+    std = np.sqrt(np.bincount(k, dev**2, minlength=npos) / n)
+    SEM = std/np.sqrt(n)
+    error_byp = np.bincount(k, abs(dev), minlength=npos) / n
+    error_byp = error_byp[first[seen].argsort()]
+    error_byp = error_byp[~np.isnan(error_byp)]
+    return (mn, std, n, SEM, encm), error_byp, inv
+
+
+def stack_interp(x, xps, fps):
+    """
+    np.interp of several (xp, fp) rows onto x in one call.
+
+    Each row is shifted along x past the one before it, so the rows, of
+    any length, are interpolated as one increasing sequence.
+
+    Parameters
+    ----------
+    x : np.array
+        positions to interpolate at
+    xps, fps : list of np.array
+        increasing positions and values of each row
+
+    Returns
+    -------
+    values : np.array
+        (rows x positions), nan outside each row's xp range
+    mask : np.array
+        (rows x positions) True where a row covers the position
+    """
+    lo = np.array([xp[0] for xp in xps])
+    hi = np.array([xp[-1] for xp in xps])
+    span = max(hi.max(), x[-1]) - min(lo.min(), x[0]) + 1
+    shift = np.arange(len(xps)) * span
+    values = np.interp(x[None, :] + shift[:, None],
+                       np.concatenate([xp + o for xp, o in zip(xps, shift)]),
+                       np.concatenate(fps))
+    mask = (x >= lo[:, None]) & (x <= hi[:, None])
+    values[~mask] = np.nan
+    return values, mask
+
+
+def _defaults(method):
+    """Keyword defaults of a method."""
+    return {k: p.default for k, p in inspect.signature(method).parameters.items()
+            if p.default is not inspect.Parameter.empty}
+
+
+def stoney(R, ni, wafer_thickness=580E-6, thick_film=False):
+    """
+    Ni film stress (Pa) from Stoney's equation.
+
+    Parameters
+    ----------
+    R : np.array
+        radius of curvature (m)
+    ni : np.array
+        Ni film thickness (m)
+    wafer_thickness : float, optional
+        Si wafer thickness (m). The default is 580E-6.
+    thick_film : bool, optional
+        add the film's own bending term. The default is False.
+    """
+    MSi = 1.803E11
+    ENi = 180E9
+    nuNi = .31
+    S = (MSi*wafer_thickness**2)/(6*ni*R)
+    if thick_film:
+        S = S + (2*ni*ENi)/(3*R*(1-nuNi))
+    return S
+
+
+def local_curvature(x, y, win=np.inf, sem=None):
+    """
+    Radius of curvature of a profile from windowed quadratic fits.
+
+    A quadratic is fitted to the w samples in win around each position,
+    windows kept inside the profile at its ends, and R = (1+y'**2)**1.5/|y''|
+    is taken at the position. All windows are fitted in one batched least
+    squares, with one solve when x is uniform.
+
+    Parameters
+    ----------
+    x, y : np.array
+        positions (mm) and profile, or (K x N) profiles at once
+    win : float, optional
+        window (mm), at least 5 samples. The default is inf, one quadratic
+        over the whole profile.
+    sem : np.array, optional
+        SEM of a single profile y, propagated to first order. The default
+        is None.
+
+    Returns
+    -------
+    R : np.array
+        radius of curvature, units of x
+    R_sem : np.array or None
+        its SEM, with sem
+    """
+    n = x.shape[0]
+    step = np.median(np.diff(x))
+    w = n if win >= x[-1] - x[0] else int(np.clip(round(win/step) | 1, 5, n))
+    start = np.clip(np.arange(n) - w//2, 0, n - w)
+    xw = sliding_window_view(x, w)
+    centre = xw.mean(1)
+    u = xw - centre[:, None]
+    if np.allclose(np.diff(x), step):
+        u = u[:1]
+    # (windows x 3 x w) least squares of c0 + c1*u + c2*u**2
+    P = np.linalg.pinv(u[..., None]**np.arange(3))
+    c = (P @ sliding_window_view(y, w, axis=-1)[..., None])[..., 0][..., start, :]
+    ui = x - centre[start]
+    ds = c[..., 1] + 2*c[..., 2]*ui
+    dds = 2*c[..., 2]
+    R = abs((1+ds**2)**1.5/dds)
+    if sem is None:
+        return R, None
+    Pi = np.broadcast_to(P[start] if P.shape[0] > 1 else P, (n, 3, w))
+    cov = np.einsum('kaj,kj,kbj->kab', Pi, sliding_window_view(sem, w)[start]**2, Pi)
+    var_ds = cov[:, 1, 1] + 4*ui*cov[:, 1, 2] + 4*ui**2*cov[:, 2, 2]
+    var_dds = 4*cov[:, 2, 2]
+    cov_ds_dds = 2*cov[:, 1, 2] + 4*ui*cov[:, 2, 2]
+    a = 3*ds*np.sqrt(1+ds**2)/abs(dds)
+    b = -R/dds
+    return R, np.sqrt(np.maximum(a**2*var_ds + b**2*var_dds + 2*a*b*cov_ds_dds, 0))
+
+
+def _shift(rows, t):
+    """Rows read at i + t (grid steps, one t per row), linear, nan outside."""
+    pos = np.arange(rows.shape[1]) + np.asarray(t, dtype=float)[:, None]
+    i = np.clip(np.floor(pos).astype(int), 0, rows.shape[1]-2)
+    w = pos - i
+    out = (np.take_along_axis(rows, i, 1)*(1-w) + np.take_along_axis(rows, i+1, 1)*w)
+    out[(pos < 0) | (pos > rows.shape[1]-1)] = np.nan
+    return out
+
+
+def fb_fuse(x, f, b, fsem, bsem, max_lag=.5):
+    """
+    Merge forward and backward scan means after removing their bias.
+
+    For each scan the lag and offset with b(x + lag) - offset = f(x) are
+    estimated, the lag from the smallest variance of f - b over integer
+    grid shifts of up to max_lag, refined to a fraction of a step by a
+    parabola through the minimum. A minimum at the edge of the search
+    means the profile is too flat to tell, the lag is then 0. Half of each is taken off either
+    direction, so the merged profile sits between them, and the two are
+    averaged with 1/SEM**2 weights.
+
+    Parameters
+    ----------
+    x : np.array
+        uniform grid (mm)
+    f, b : np.array
+        (scans x grid) forward and backward means, nan where not covered
+    fsem, bsem : np.array
+        (scans x grid) their SEM
+    max_lag : float, optional
+        largest lag searched (mm). The default is .5.
+
+    Returns
+    -------
+    fused, sem : np.array
+        (scans x grid) merged means and their SEM
+    lag, offset : np.array
+        per scan, lag in mm
+    """
+    h = x[1] - x[0]
+    # lag and offset from the columns every row covers
+    both = np.flatnonzero(~np.isnan(f).any(0) & ~np.isnan(b).any(0))
+    if both.size < 8:
+        raise ValueError('forward and backward scans have too few positions in common')
+    cf, cb = f[:, both[0]:both[-1]+1], b[:, both[0]:both[-1]+1]
+    L = int(min(max(round(max_lag/h), 1), (cf.shape[1]-1)//4))
+    rows = np.arange(f.shape[0])
+    # variance of f[i] - b[i+s] for every shift s in -L..L, all scans at once
+    cost = (cf[:, None, L:cf.shape[1]-L] -
+            sliding_window_view(cb, cf.shape[1]-2*L, axis=1)).var(axis=2)
+    k = cost.argmin(1)
+    edge = (k == 0) | (k == 2*L)
+    k = np.where(edge, L, k)
+    c0, c1, c2 = cost[rows, k-1], cost[rows, k], cost[rows, k+1]
+    den = c0 - 2*c1 + c2
+    step = np.where(den > 0, .5*(c0 - c2)/np.where(den > 0, den, 1), 0)
+    lag = np.where(edge, 0, (k - L + np.clip(step, -.5, .5))*h)
+    t = lag/h/2
+    fc, bc = _shift(f, -t), _shift(b, t)
+    offset = np.nanmean(bc - fc, axis=1)
+    fc = fc + offset[:, None]/2
+    bc = bc - offset[:, None]/2
+
+    def weight(sem, v):
+        # a position seen by one pass has no spread, give it the scan's typical SEM
+        sem = np.where(sem > 0, sem, np.nanmedian(np.where(sem > 0, sem, np.nan), 1)[:, None])
+        return np.where(np.isnan(v), 0, 1/sem**2)
+
+    wf, wb = weight(_shift(fsem, -t), fc), weight(_shift(bsem, t), bc)
+    w = wf + wb
+    with np.errstate(invalid='ignore', divide='ignore'):
+        fused = (wf*np.nan_to_num(fc) + wb*np.nan_to_num(bc))/w
+        sem = 1/np.sqrt(w)
+    sem[w == 0] = np.nan
+    return fused, sem, lag, offset
+
+
+def _dedupe(k, y, dup):
+    """Sorted unique positions k and one y per position."""
+    if dup == 'mean':
+        u, inv = np.unique(k, return_inverse=True)
+        inv = inv.ravel()
+        n = np.bincount(inv, minlength=u.shape[0])
+        y = np.asarray(y, dtype=float)
+        Y = np.zeros((u.shape[0],) + y.shape[1:])
+        np.add.at(Y, inv, y)
+        return u, Y / n.reshape((-1,) + (1,)*(y.ndim-1))
+    if dup == 'last':
+        u, i = np.unique(k[::-1], return_index=True)
+        i = k.shape[0] - 1 - i
+    elif dup == 'first':
+        u, i = np.unique(k, return_index=True)
+    else:
+        raise ValueError('dup must be last, first or mean')
+    return u, np.asarray(y)[i]
+
+
+def syncstuff(x1, y1, x2, y2, dm=False, r=2, tol=None, dup='last'):
+    """
+    Pair up y1 and y2 on the positions x1 and x2 have in common.
+
+    Parameters
+    ----------
+    x1, y1, x2, y2 : np.array
+        positions (mm) and values of the two profiles
+    dm : bool, optional
+        subtract the mean of y1 and y2. The default is False.
+    r : int, optional
+        positions are binned to r decimals, exact float match if 0. The default is 2.
+    tol : float, optional
+        join each x1 position to the nearest x2 position within tol (mm)
+        instead of requiring the same position. The default is None.
+    dup : String, optional
+        value kept for a position that shows up more than once, 'last',
+        'first' or 'mean'. The default is 'last'.
+
+    Returns
+    -------
+    X, Y1, Y2 : np.array
+        common positions (x1's in tol mode) and the paired values
+    """
+    if r:
+        grid = EncGrid(10.**-r)
+        k1 = grid.bins(x1)
+        k2 = grid.bins(x2)
     else:
-        f = dict(zip(x1, y1))
-        b = dict(zip(x2, y2))
+        k1 = np.asarray(x1)
+        k2 = np.asarray(x2)
 
-    X = [*set.intersection(set(x1), set(x2))]
-    X.sort()
+    if dm:
+        y1 = y1-y1.mean()
+        y2 = y2-y2.mean()
 
-    Y1 = []
-    Y2 = []
+    k1, y1 = _dedupe(k1, y1, dup)
+    k2, y2 = _dedupe(k2, y2, dup)
 
-    for i in X:
-        if i in f.keys() and i in b.keys():
-            Y1.append(f[i])
-            Y2.append(b[i])
-    return map(lambda x: np.array(x), [X, Y1, Y2])
+    if tol is None:
+        X, i1, i2 = np.intersect1d(k1, k2, assume_unique=True, return_indices=True)
+    else:
+        if r:
+            tol = tol*grid.scale
+        if k2.shape[0] == 0:
+            # nothing to join to
+            j = np.empty(0, dtype=int)
+            k1 = k1[:0]
+        elif k2.shape[0] == 1:
+            j = np.zeros(k1.shape[0], dtype=int)
+        else:
+            j = np.clip(np.searchsorted(k2, k1), 1, k2.shape[0]-1)
+            left = k1 - k2[j-1] <= k2[j] - k1
+            j = np.where(left, j-1, j)
+        i1 = np.flatnonzero(abs(k2[j] - k1) <= tol)
+        i2 = j[i1]
+        X = k1[i1]
+    if r:
+        X = grid.x(X)
+    return X, y1[i1], y2[i2]
 
 
 def exFilter(size):
     # make filter for scans
-    def filt(lzr):
-        lzr = signal.medfilt(lzr, 65)
-        lzr = uniform_filter1d(lzr, size)
-        return lzr
-    return filt
+    return Filters.MedianMean(size, 65)
 
 
 def wFilter(size):
     # make filter for processed scans
-    def filt(lzr):
-        lzr = signal.medfilt(lzr, size)
-        return lzr
-    return filt
+    return Filters.Median(size)
 
 
 def sFilter(Ex, size):
     # make filter for calculating stress
-    def filt(lzr):
-        lzr = signal.medfilt(lzr, 129)
-        z = np.polyfit(Ex.sync_stress_x, lzr, size)
-        p = np.poly1d(z)
-        lzr = p(Ex.sync_stress_x)
-        return lzr
-    return filt
+    return Filters.PolyFit(Ex, size, median=129)
 
 
 def nFilter(Ex, size):
     # make filter for calculating load
-    def filt(lzr):
-        z = np.polyfit(Ex.sync_stress_x, lzr, size)
-        p = np.poly1d(z)
-        lzr = p(Ex.sync_stress_x)
-        return lzr
-    return filt
+    return Filters.PolyFit(Ex, size)
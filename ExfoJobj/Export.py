@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Load profile export for the tool's load controller.
+
+A Load profile is resampled to the wafer length in points, converted to
+kg, padded out to the scan window with its end values and given a ramp
+up from zero. table() does this for stacks of profiles as array
+operations, tables() for several wafer sizes and windows in one pass.
+
+Besides CSV, tables are written as binary setpoint tables (.spt) that can
+be streamed to the controller as they are: a fixed header, JSON metadata
+and the setpoints as little endian float32 or as fixed point counts of
+1/scale kg. The header holds a CRC32 of the whole file and the metadata
+a stamp of the setpoints and export settings, so read() rejects a damaged
+file and, given the stamp expected, a stale one. A CSV file has nowhere
+to keep settings, its stamp is of the setpoints alone; check() tests
+either kind of file against the stamp export() returned for it.
+
+    magic 'EXSP', version u2, dtype code u1, reserved u1,
+    profiles u4, points u4, scale f8, metadata bytes u4, crc32 u4,
+    metadata (utf-8 JSON), profiles x points setpoints
+"""
+import hashlib
+import json
+import struct
+import time
+import zlib
+from pathlib import Path
+
+import numpy as np
+
+VERSION = 1
+MAGIC = b'EXSP'
+SUFFIX = '.spt'
+HEADER = struct.Struct('<4sHBBIIdII')
+# format: dtype code, numpy dtype
+DTYPES = {'f32': (1, '<f4'), 'u16': (2, '<u2'), 'i32': (3, '<i4')}
+FORMATS = ('csv',) + tuple(DTYPES)
+# Load is in N, setpoints in kg
+G = 9.81
+
+
+def resample(Load, points):
+    """
+    Profiles linearly resampled to points, as np.interp does for each.
+
+    Parameters
+    ----------
+    Load : np.array
+        (N) profile or (profiles x N) stack
+    points : int
+        samples per profile
+
+    Returns
+    -------
+    np.array
+        (... x points)
+    """
+    Load = np.asarray(Load, dtype=float)
+    n = Load.shape[-1]
+    x = np.linspace(0, n-1, points)
+    j = np.minimum(x.astype(int), max(n-2, 0))
+    if n == 1:
+        return np.repeat(Load, points, -1)
+    out = (Load[..., j+1] - Load[..., j])*(x - j) + Load[..., j]
+    out[..., x == n-1] = Load[..., -1:]
+    return out
+
+
+def table(Load, wafer_points=3000, ramp=False, window=False):
+    """
+    Setpoints (kg) of one or a stack of Load profiles.
+
+    Parameters
+    ----------
+    Load : np.array
+        (N) or (profiles x N) Load (N)
+    wafer_points : int, optional
+        setpoints over the wafer. The default is 3000.
+    ramp : int, optional
+        setpoints ramping up from 0 before the profile. The default is False.
+    window : int, optional
+        setpoints of the whole scan, the profile is centred and padded with
+        its end values. The default is False.
+
+    Returns
+    -------
+    np.array
+        (... x ramp + window) setpoints
+    """
+    return _frame(resample(Load, wafer_points)/G, wafer_points, ramp, window)
+
+
+def _frame(L, wafer_points, ramp, window):
+    """Pad resampled setpoints to the window and prepend the ramp."""
+    if window:
+        pad = int((window-wafer_points)/2)
+        if pad < 0:
+            raise ValueError('window is shorter than the wafer')
+        L = np.pad(L, [(0, 0)]*(L.ndim-1) + [(pad, pad)], mode='edge')
+    if ramp:
+        L = np.concatenate((np.linspace(0, L[..., 0], ramp, axis=-1), L), -1)
+    return L
+
+
+def tables(Load, wafer_points=3000, ramp=False, window=False):
+    """
+    Setpoint tables for several wafer sizes and windows.
+
+    wafer_points and window are broadcast against each other, each size is
+    resampled once.
+
+    Returns
+    -------
+    dict
+        (wafer_points, window) to table
+    """
+    points, windows = np.broadcast_arrays(np.asarray(wafer_points), np.asarray(window))
+    out = {}
+    resampled = {}
+    for p, w in zip(points.ravel().tolist(), windows.ravel().tolist()):
+        if p not in resampled:
+            resampled[p] = resample(Load, p)/G
+        out[p, w] = _frame(resampled[p], p, ramp, w)
+    return out
+
+
+def stamp(setpoints, **settings):
+    """Hex digest of the setpoints (kg) and the settings they were exported with."""
+    h = hashlib.sha1(np.ascontiguousarray(setpoints, dtype='<f8').tobytes())
+    h.update(json.dumps(settings, sort_keys=True, default=str).encode())
+    return h.hexdigest()
+
+
+def write(path, setpoints, fmt='f32', scale=100, meta=None):
+    """
+    Write a setpoint table file.
+
+    Parameters
+    ----------
+    path : Path
+    setpoints : np.array
+        (points) or (profiles x points) setpoints (kg)
+    fmt : String, optional
+        'f32', or fixed point 'u16' or 'i32' counts of 1/scale kg. The
+        default is 'f32'.
+    scale : float, optional
+        counts per kg of the fixed point formats. The default is 100.
+    meta : dict, optional
+        export settings and anything else to keep with the table, they go
+        into the stamp
+
+    Returns
+    -------
+    String
+        the stamp written
+    """
+    if fmt not in DTYPES:
+        raise ValueError('unknown setpoint format {}, one of {}'.format(fmt, [*DTYPES]))
+    setpoints = np.atleast_2d(np.asarray(setpoints, dtype=float))
+    code, dtype = DTYPES[fmt]
+    dtype = np.dtype(dtype)
+    if dtype.kind == 'f':
+        scale = 1.
+        data = setpoints.astype(dtype)
+    else:
+        counts = np.rint(setpoints*scale)
+        info = np.iinfo(dtype)
+        if counts.min() < info.min or counts.max() > info.max:
+            raise ValueError('setpoints out of range for {} at scale {}'.format(fmt, scale))
+        data = counts.astype(dtype)
+    meta = dict(meta or {})
+    meta['stamp'] = stamp(setpoints, **meta)
+    meta.update(format=fmt, units='kg', created=time.strftime('%Y-%m-%d %H:%M:%S'))
+    body = json.dumps(meta, sort_keys=True, default=str).encode()
+    payload = data.tobytes()
+    fields = [MAGIC, VERSION, code, 0, setpoints.shape[0], setpoints.shape[1], scale, len(body)]
+    crc = zlib.crc32(payload, zlib.crc32(body, zlib.crc32(HEADER.pack(*fields, 0))))
+    with open(path, 'wb') as f:
+        f.write(HEADER.pack(*fields, crc))
+        f.write(body)
+        f.write(payload)
+    return meta['stamp']
+
+
+def read(path, stamp=None):
+    """
+    Read a setpoint table file, checking it.
+
+    Parameters
+    ----------
+    path : Path
+    stamp : String, optional
+        stamp the table has to have, e.g. of the profile about to be run
+
+    Raises
+    ------
+    ValueError
+        When the file is not a setpoint table, is damaged or has another stamp.
+
+    Returns
+    -------
+    setpoints : np.array
+        (profiles x points) setpoints (kg)
+    meta : dict
+    """
+    with open(path, 'rb') as f:
+        raw = f.read()
+    if len(raw) < HEADER.size or raw[:4] != MAGIC:
+        raise ValueError('{} is not a setpoint table'.format(path))
+    magic, version, code, _, profiles, points, scale, size, crc = HEADER.unpack_from(raw)
+    if version != VERSION:
+        raise ValueError('unknown setpoint table version {}'.format(version))
+    body = raw[HEADER.size:HEADER.size+size]
+    payload = raw[HEADER.size+size:]
+    head = HEADER.pack(magic, version, code, 0, profiles, points, scale, size, 0)
+    if zlib.crc32(payload, zlib.crc32(body, zlib.crc32(head))) != crc:
+        raise ValueError('{} is damaged, checksum mismatch'.format(path))
+    meta = json.loads(body)
+    if stamp is not None and meta.get('stamp') != stamp:
+        raise ValueError('{} is stale, stamp {} is not {}'.format(path, meta.get('stamp'), stamp))
+    dtype = {c: np.dtype(d) for c, d in DTYPES.values()}[code]
+    data = np.frombuffer(payload, dtype=dtype).reshape(profiles, points).astype(float)
+    return data/scale, meta
+
+
+def check(path, expected):
+    """
+    Whether an exported file is intact and has the stamp export gave it.
+
+    Setpoint tables are checked by read, CSV files by the stamp of the
+    setpoints read back, which savetxt writes exactly.
+    """
+    path = Path(path)
+    try:
+        if path.suffix == SUFFIX:
+            read(path, expected)
+            return True
+        return stamp(np.loadtxt(path, delimiter=',').T) == expected
+    except (OSError, ValueError):
+        return False
+
+
+def export(path, Load, wafer_points=3000, ramp=False, window=False, fmt='csv', scale=100,
+           meta=None):
+    """
+    Write the setpoint tables of Load for each wafer size and window.
+
+    Parameters
+    ----------
+    path : Path
+        output file, the suffix is set by fmt. With several sizes or windows
+        each file gets _<wafer_points>_<window> added to its name.
+    Load : np.array
+        (N) or (profiles x N) Load (N)
+    fmt : String, optional
+        'csv' or a setpoint table format of write. The default is 'csv'.
+    wafer_points, ramp, window
+        see table, wafer_points and window can be lists
+    scale, meta
+        see write
+
+    Returns
+    -------
+    list
+        (path, stamp) of the files written, see check
+    """
+    if fmt not in FORMATS:
+        raise ValueError('unknown export format {}, one of {}'.format(fmt, FORMATS))
+    path = Path(path)
+    out = tables(Load, wafer_points, ramp, window)
+    written = []
+    for (points, win), setpoints in out.items():
+        name = path if len(out) == 1 else path.with_name(
+            '{}_{}_{}{}'.format(path.stem, points, win or 0, path.suffix))
+        if fmt == 'csv':
+            name = name.with_suffix('.csv')
+            np.savetxt(name, setpoints.T, delimiter=',')
+            written.append((name, stamp(setpoints)))
+        else:
+            settings = dict(meta or {}, wafer_points=points, window=win, ramp=ramp)
+            name = name.with_suffix(SUFFIX)
+            written.append((name, write(name, setpoints, fmt, scale, settings)))
+    return written
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Running median filters.
+
+signal.medfilt sorts every window from scratch, O(N k) with a large
+constant, which is most of the time spent filtering encoder (k=21) and
+laser (k=65, 129) channels. median gives the same result, zero padded
+edges included, from ndimage's running 1-D median, and filters stacked
+passes along one axis. ndimage only has the fast path for 1-D input, so
+a stack is laid out as one line, its rows separated by size//2 zeros that
+stand in for each row's zero padding, and filtered in one call.
+
+The filters handed to Scan and the ExfoJobj stages are Filter objects:
+filt(lzr) filters one pass or profile, filt.batch(stack, lengths) filters
+stacked passes of different lengths at once with the same result as
+filtering each pass on its own. batch works on any callable, so plain
+functions still do as filters.
+
+scipy.ndimage is imported on the first filter call, not with the module.
+"""
+from abc import ABC, abstractmethod
+
+import numpy as np
+
+
+def median(x, size, axis=-1):
+    """
+    Median filter along one axis, same as signal.medfilt on each line.
+
+    Parameters
+    ----------
+    x : np.array
+        data, 1-D or stacked passes
+    size : int
+        odd kernel size
+    axis : int, optional
+        axis filtered along. The default is -1.
+
+    Returns
+    -------
+    np.array
+        filtered data, same shape and dtype as x
+    """
+    from scipy import ndimage
+    if size % 2 != 1:
+        raise ValueError('median kernel size should be odd')
+    x = np.asarray(x)
+    if x.ndim == 1:
+        return ndimage.median_filter(x, size, mode='constant', cval=0)
+    lines = np.moveaxis(x, axis, -1)
+    n = lines.shape[-1]
+    h = size//2
+    flat = np.zeros(lines.shape[:-1] + (h + n,), dtype=x.dtype)
+    flat[..., h:] = lines
+    out = ndimage.median_filter(flat.ravel(), size, mode='constant', cval=0)
+    return np.moveaxis(out.reshape(flat.shape)[..., h:], -1, axis)
+
+
+def reflect_pad(stack, lengths, pad):
+    """
+    Stacked passes padded by pad samples mirrored at each pass's own ends.
+
+    Matches ndimage's 'reflect' mode (d c b a | a b c d | d c b a) for
+    every pass, so a filter run along the rows of the padded stack sees
+    each pass as if it was filtered alone.
+    """
+    lengths = np.asarray(lengths)[:, None]
+    if pad > lengths.min():
+        # mirrored more than once, index every sample
+        j = np.arange(-pad, stack.shape[1] + pad) % (2*lengths)
+        j = np.where(j < lengths, j, 2*lengths - 1 - j)
+        return np.take_along_axis(stack, j, 1)
+    out = np.zeros((stack.shape[0], stack.shape[1] + 2*pad))
+    out[:, pad:pad+stack.shape[1]] = stack
+    out[:, :pad] = stack[:, pad-1::-1]
+    rows = np.arange(stack.shape[0])[:, None]
+    out[rows, pad + lengths + np.arange(pad)] = stack[rows, lengths - 1 - np.arange(pad)]
+    return out
+
+
+def batch(filt, stack, lengths=None):
+    """
+    Filter stacked passes (passes x samples) with a Filter or plain function.
+
+    Parameters
+    ----------
+    filt : Filter or Function
+        filtering function lzr = filt(lzr)
+    stack : np.array
+        passes x samples, row i holds lengths[i] samples then anything
+    lengths : array, optional
+        samples per pass. The default is the full rows.
+
+    Returns
+    -------
+    np.array
+        filtered stack, zero past each pass's length
+    """
+    stack = np.asarray(stack, dtype=float)
+    if lengths is None:
+        lengths = np.full(stack.shape[0], stack.shape[1])
+    if isinstance(filt, Filter):
+        return filt.batch(stack, lengths)
+    return Filter.batch(filt, stack, lengths)
+
+
+class Filter(ABC):
+    """
+    Filter of a pass or profile, lzr = filt(lzr).
+
+    Subclasses implement __call__ and, where it pays off, a vectorized
+    batch. Parameters are kept as attributes, they identify the filter
+    for StageCache.
+    """
+
+    @abstractmethod
+    def __call__(self, lzr):
+        """Filtered copy of one pass or profile."""
+
+    def batch(self, stack, lengths):
+        """Filter each row up to its length, one call per pass."""
+        out = np.zeros(stack.shape)
+        for i, n in enumerate(lengths):
+            out[i, :n] = self(stack[i, :n])
+        return out
+
+    def fingerprint(self):
+        return (type(self).__qualname__,) + tuple(
+            (k, v) for k, v in sorted(vars(self).items()) if k != 'Ex')
+
+    def __repr__(self):
+        return '{}({})'.format(type(self).__name__, ', '.join(
+            '{}={!r}'.format(k, v) for k, v in vars(self).items() if k != 'Ex'))
+
+
+class Median(Filter):
+    """Running median of size samples (wFilter)."""
+
+    def __init__(self, size):
+        self.size = size
+
+    def __call__(self, lzr):
+        return median(lzr, self.size)
+
+    def batch(self, stack, lengths):
+        # zeros past each pass are the zero padding medfilt uses
+        stack = np.where(np.arange(stack.shape[1]) < np.asarray(lengths)[:, None], stack, 0)
+        return median(stack, self.size, axis=1)
+
+
+class MedianMean(Filter):
+    """Running median of median samples then a moving average of size (exFilter)."""
+
+    def __init__(self, size, median=65):
+        self.size = size
+        self.median = median
+
+    def __call__(self, lzr):
+        from scipy import ndimage
+        lzr = median(lzr, self.median)
+        return ndimage.uniform_filter1d(lzr, self.size)
+
+    def batch(self, stack, lengths):
+        from scipy import ndimage
+        stack = Median(self.median).batch(stack, lengths)
+        # the moving average reflects at each pass's end, not at the stack's
+        pad = self.size//2 + 1
+        out = ndimage.uniform_filter1d(reflect_pad(stack, lengths, pad), self.size, axis=1)
+        out = out[:, pad:pad+stack.shape[1]]
+        out[np.arange(stack.shape[1]) >= np.asarray(lengths)[:, None]] = 0
+        return out
+
+
+class PolyFit(Filter):
+    """
+    Polynomial of degree size fitted over Ex.sync_stress_x (sFilter, nFilter).
+
+    With median, a running median of that size is applied first.
+    """
+
+    def __init__(self, Ex, size, median=None):
+        self.Ex = Ex
+        self.size = size
+        self.median = median
+
+    def __call__(self, lzr):
+        if self.median:
+            lzr = median(lzr, self.median)
+        x = self.Ex.sync_stress_x
+        return np.poly1d(np.polyfit(x, lzr, self.size))(x)
+
+    def batch(self, stack, lengths):
+        # profiles share x, one least squares fit for all of them
+        if np.any(np.asarray(lengths) != stack.shape[1]):
+            return Filter.batch(self, stack, lengths)
+        if self.median:
+            stack = median(stack, self.median, axis=1)
+        x = self.Ex.sync_stress_x
+        z = np.polyfit(x, stack.T, self.size)
+        return (np.vander(x, self.size + 1) @ z).T
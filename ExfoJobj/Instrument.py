@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Logging, timing and trace output.
+
+Progress messages, stage timings, sample and pass counts and events such
+as encoder jumps go to the 'ExfoJobj' logger. Nothing is shown unless a
+handler is added, so batch runs stay quiet; console() prints the messages
+like the old print calls did and trace() writes every record, with its
+fields, as one JSON line to a file.
+
+timer times any block or function, with the traced memory high-water mark
+when memory=True:
+
+    with Instrument.timer('sync', memory=True):
+        Ex.Wafer_Sync()
+"""
+import contextlib
+import copy
+import json
+import logging
+import threading
+import time
+import tracemalloc
+
+log = logging.getLogger('ExfoJobj')
+log.addHandler(logging.NullHandler())
+# timers record the memory high-water mark, set by trace(memory=True)
+MEMORY = False
+# peaks of the open memory timers of a thread, outermost first; an inner timer
+# resets the tracemalloc peak, so it hands what it erased and its own peak up
+_LOCAL = threading.local()
+
+
+def _peaks():
+    if not hasattr(_LOCAL, 'peaks'):
+        _LOCAL.peaks = []
+    return _LOCAL.peaks
+
+
+def event(name, msg='', level=logging.INFO, **fields):
+    """Log msg with name and fields kept on the record for trace()."""
+    log.log(level, msg or name, extra={'event': name, 'fields': fields})
+
+
+def console(level=logging.INFO):
+    """Print messages of level and above, returns the handler."""
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    handler.setLevel(level)
+    log.addHandler(handler)
+    log.setLevel(min(level, log.level) if log.level else level)
+    return handler
+
+
+class JSONLines(logging.Handler):
+    """Write records as JSON lines: time, level, event, message and fields."""
+
+    def __init__(self, path):
+        super().__init__()
+        self.file = open(path, 'a')
+
+    def emit(self, record):
+        line = {'time': record.created, 'level': record.levelname,
+                'event': getattr(record, 'event', None), 'message': record.getMessage(),
+                **getattr(record, 'fields', {})}
+        self.file.write(json.dumps(line, default=str) + '\n')
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+        super().close()
+
+
+def trace(path, level=logging.DEBUG, memory=False):
+    """
+    Append every record of level and above to a JSON lines file.
+
+    With memory, stage timers also record their peak traced memory.
+    Returns the handler.
+    """
+    global MEMORY
+    MEMORY = memory
+    handler = JSONLines(path)
+    handler.setLevel(level)
+    log.addHandler(handler)
+    log.setLevel(min(level, log.level) if log.level else level)
+    return handler
+
+
+def remove(handler):
+    """Detach and close a handler made by console or trace."""
+    log.removeHandler(handler)
+    handler.close()
+
+
+class timer(contextlib.ContextDecorator):
+    """
+    Time a block or function and log it as a 'timer' event.
+
+    Parameters
+    ----------
+    name : String
+        stage name
+    memory : bool, optional
+        also record the peak traced memory, slows the block down.
+        The default is None, as set by trace().
+    fields
+        extra values logged with the timing
+
+    Attributes
+    ----------
+    seconds : float
+    peak : int
+        bytes, with memory, high-water mark of the block including nested timers
+
+    Notes
+    -----
+    As a decorator every call runs on its own copy, so recursive and
+    threaded calls don't share their start time or tracing state; the
+    attributes are only set on timers used in a with statement.
+    """
+
+    def __init__(self, name, memory=None, **fields):
+        self.name = name
+        self.memory = memory
+        self.fields = fields
+        self.seconds = None
+        self.peak = None
+
+    def _recreate_cm(self):
+        return copy.copy(self)
+
+    def __enter__(self):
+        self._memory = MEMORY if self.memory is None else self.memory
+        self._traced = self._memory and not tracemalloc.is_tracing()
+        if self._traced:
+            tracemalloc.start()
+        elif self._memory:
+            peaks = _peaks()
+            if peaks:
+                peaks[-1] = max(peaks[-1], tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        if self._memory:
+            _peaks().append(0)
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.seconds = time.perf_counter() - self._start
+        fields = dict(self.fields, seconds=self.seconds)
+        if self._memory:
+            peaks = _peaks()
+            self.peak = max(peaks.pop(), tracemalloc.get_traced_memory()[1])
+            if peaks:
+                peaks[-1] = max(peaks[-1], self.peak)
+            fields['peak'] = self.peak
+            if self._traced:
+                tracemalloc.stop()
+        event('timer', '{} {:.4f} s'.format(self.name, self.seconds), logging.DEBUG,
+              stage=self.name, **fields)
+        return False
+
+
+class _Collect(logging.Handler):
+    def __init__(self):
+        super().__init__(logging.DEBUG)
+        self.records = []
+
+    def emit(self, record):
+        # keep the formatted message so the record pickles without its args
+        record.msg = record.getMessage()
+        record.args = None
+        record.exc_info = None
+        self.records.append(record)
+
+
+@contextlib.contextmanager
+def capture():
+    """
+    Collect the records logged in the block instead of emitting them.
+
+    Used in worker processes, the parent replays them with replay().
+    """
+    handler = _Collect()
+    level, propagate, handlers = log.level, log.propagate, log.handlers
+    log.handlers = [handler]
+    log.propagate = False
+    log.setLevel(logging.DEBUG)
+    try:
+        yield handler.records
+    finally:
+        log.handlers, log.propagate = handlers, propagate
+        log.setLevel(level)
+
+
+def replay(records):
+    """Emit records collected by capture, in order."""
+    for record in records:
+        if log.isEnabledFor(record.levelno):
+            log.handle(record)
@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Live scan building from the DAQ serial feed.
+
+StreamScan takes (time, enc, lzr[, load]) chunks as they arrive, finds the
+scan passes the same way Scan does (median filtered encoder inside
+llim-ulim) and keeps a running mean and std per encoder position with
+Welford accumulators, so fmeans/bmeans can be read at any time during a
+run.
+
+SerialSource reads the space separated lines printed by ToolDAQ.ino from a
+serial port, or from anything with a readline method such as ReplaySource,
+which plays a recorded scan back at a chosen speed. A read that times out
+is only a gap in the feed, run keeps polling until its callback stops it,
+the feed has been idle too long or the source is done (port closed,
+recording played out).
+"""
+import time as _time
+from pathlib import Path
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+import ScanCache
+
+
+class StreamScan(object):
+    """
+    Incremental Scan.
+
+    Parameters
+    ----------
+    llim : int, optional
+        Lower scan cutoff in mm. The default is 41.
+    ulim : int, optional
+        Upper scan cutoff in mm. The default is 65.
+    trim : list, optional
+        Passes to skip, counted from 0. The default is ().
+    filt : Function, optional
+        filtering function lzr = filt(lzr), applied to each finished pass
+    kernel : int, optional
+        Encoder median filter size, as in Scan. The default is 21.
+
+    Notes
+    -----
+    Scan trims every pass to the shortest one before averaging; a live scan
+    can't know the shortest pass in advance, so whole passes are used.
+    Passes are added to the statistics when the encoder leaves llim-ulim.
+    """
+
+    def __init__(self, llim=41, ulim=65, trim=(), filt=None, kernel=21):
+        self.llim = llim
+        self.ulim = ulim
+        self.trim = set(trim)
+        self.filt = filt
+        self.kernel = kernel
+        # encoder bins of 10um, as in the raw encoder data
+        self.b0 = int(np.floor(llim*100))
+        nb = int(np.ceil(ulim*100)) - self.b0 + 1
+        self.acc = {d: {'n': np.zeros(nb), 'mean': np.zeros(nb), 'm2': np.zeros(nb)}
+                    for d in 'fb'}
+        # raw encoder context for the centered median filter, zero padded like medfilt
+        self._ebuf = np.zeros(kernel//2)
+        # values waiting for their filtered encoder
+        self._pend = np.empty(0)
+        self._run = None
+        self.passes = 0
+        self.kept = 0
+        self.samples = 0
+
+    def feed(self, time, enc, lzr, load=None):
+        """
+        Add a chunk of samples.
+
+        Only enc and lzr are used, time and load are taken so a chunk of
+        the DAQ feed can be passed as it comes.
+        """
+        enc = np.asarray(enc, dtype=float)
+        self.samples += enc.shape[0]
+        self._ebuf = np.concatenate((self._ebuf, enc))
+        self._pend = np.concatenate((self._pend, np.asarray(lzr, dtype=float)))
+        self._emit()
+
+    def close(self):
+        """Flush the samples held back by the median filter and finish the open pass."""
+        self._ebuf = np.concatenate((self._ebuf, np.zeros(self.kernel//2)))
+        self._emit()
+        if self._run is not None:
+            self._end_pass()
+
+    def _emit(self):
+        # filtered encoder for every sample with a full window around it
+        if self._ebuf.shape[0] < self.kernel:
+            return
+        enc = np.median(sliding_window_view(self._ebuf, self.kernel), axis=1) / 100
+        self._ebuf = self._ebuf[enc.shape[0]:]
+        lzr = self._pend[:enc.shape[0]]
+        self._pend = self._pend[enc.shape[0]:]
+
+        inside = (enc >= self.llim) & (enc <= self.ulim)
+        edges = np.flatnonzero(np.diff(inside.view(np.int8))) + 1
+        for a, b in zip(np.r_[0, edges], np.r_[edges, enc.shape[0]]):
+            if inside[a]:
+                if self._run is None:
+                    self._run = ([], [])
+                self._run[0].append(enc[a:b])
+                self._run[1].append(lzr[a:b])
+            elif self._run is not None:
+                self._end_pass()
+
+    def _end_pass(self):
+        enc, lzr = [np.concatenate(c) for c in self._run]
+        self._run = None
+        self.passes += 1
+        if self.passes - 1 in self.trim:
+            return
+        d = 'fb'[self.kept % 2]
+        self.kept += 1
+        if self.filt:
+            lzr = self.filt(lzr)
+        bins = np.rint(enc*100).astype(np.int64) - self.b0
+        # one value per position per pass, the last one as in Scan
+        _, last = np.unique(bins[::-1], return_index=True)
+        keep = bins.shape[0] - 1 - last
+        b = bins[keep]
+        v = lzr[keep]
+
+        acc = self.acc[d]
+        n = acc['n'][b] + 1
+        delta = v - acc['mean'][b]
+        acc['mean'][b] += delta / n
+        acc['m2'][b] += delta * (v - acc['mean'][b])
+        acc['n'][b] = n
+
+    def means(self, d='f'):
+        """Current (mn, std, n, SEM, encm) in direction d, like Scan.fmeans."""
+        acc = self.acc[d]
+        sel = np.flatnonzero(acc['n'])
+        n = acc['n'][sel]
+        mn = acc['mean'][sel]
+        std = np.sqrt(acc['m2'][sel] / n)
+        SEM = std/np.sqrt(n)
+        encm = (sel + self.b0) / 100
+        return mn, std, n, SEM, encm
+
+    @property
+    def fmeans(self):
+        return self.means('f')
+
+    @property
+    def bmeans(self):
+        return self.means('b')
+
+
+def parse_lines(lines, columns=('time', 'encoder', 'load')):
+    """
+    Parse space separated DAQ lines into arrays.
+
+    Lines that don't have one number per column (partial lines at start up,
+    serial noise) are dropped.
+
+    Returns
+    -------
+    dict
+        column name to array
+    """
+    rows = []
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode('ascii', 'ignore')
+        parts = line.split()
+        if len(parts) != len(columns):
+            continue
+        try:
+            rows.append([float(p) for p in parts])
+        except ValueError:
+            continue
+    data = np.array(rows, dtype=float).reshape(-1, len(columns))
+    return {c: data[:, i] for i, c in enumerate(columns)}
+
+
+class SerialSource(object):
+    """
+    Chunked reader for the ToolDAQ serial feed.
+
+    Parameters
+    ----------
+    port : String or object
+        serial port name, opened with pyserial, or any object with readline
+    baud : int, optional
+        The default is 115200, as set in ToolDAQ.ino.
+    columns : tuple, optional
+        names of the printed columns. The default is ('time', 'encoder', 'load').
+    timeout : float, optional
+        seconds a readline waits for the port. The default is 1.
+    """
+
+    def __init__(self, port, baud=115200, columns=('time', 'encoder', 'load'), timeout=1):
+        if isinstance(port, str):
+            import serial
+            port = serial.Serial(port, baud, timeout=timeout)
+        self.port = port
+        self.columns = columns
+        # a line cut by a read timeout, finished by the next read
+        self.partial = b''
+
+    @property
+    def done(self):
+        """True once the port is closed or a replay has played out."""
+        if getattr(self.port, 'done', False):
+            return True
+        return not getattr(self.port, 'is_open', True)
+
+    def read(self, lines=256):
+        """Read up to lines lines, returns early (maybe empty) when the port times out."""
+        buf = []
+        if self.done:
+            return parse_lines(buf, self.columns)
+        for _ in range(lines):
+            line = self.port.readline()
+            if isinstance(line, str):
+                line = line.encode('ascii', 'ignore')
+            if not line:
+                break
+            line = self.partial + line
+            if not line.endswith(b'\n'):
+                self.partial = line
+                break
+            self.partial = b''
+            buf.append(line)
+        return parse_lines(buf, self.columns)
+
+
+class ReplaySource(object):
+    """
+    Fake serial port that plays a recorded scan back line by line.
+
+    Parameters
+    ----------
+    data : dict
+        channel name to array, as returned by ScanCache.read
+    speed : float, optional
+        playback speed relative to the recorded time, 0 for no waiting.
+        The default is 1.
+    columns : tuple, optional
+        channels written on each line. The default is
+        ('time', 'encoder', 'laser', 'load').
+    """
+
+    def __init__(self, data, speed=1, columns=('time', 'encoder', 'laser', 'load')):
+        self.rows = np.stack([np.asarray(data[c], dtype=float) for c in columns], 1)
+        self.t = np.asarray(data['time'], dtype=float)
+        self.t = self.t - self.t[0]
+        self.speed = speed
+        self.i = 0
+        self.start = None
+
+    @property
+    def done(self):
+        return self.i >= self.rows.shape[0]
+
+    def readline(self):
+        if self.i >= self.rows.shape[0]:
+            return b''
+        if self.speed:
+            if self.start is None:
+                self.start = _time.monotonic()
+            wait = self.t[self.i]/self.speed - (_time.monotonic()-self.start)
+            if wait > 0:
+                _time.sleep(wait)
+        line = ' '.join(map(repr, self.rows[self.i].tolist())) + '\r\n'
+        self.i += 1
+        return line.encode('ascii')
+
+
+def replay(filepath, file, speed=0, **kwargs):
+    """
+    SerialSource playing back a recorded scan (.npc, .tdms or .dat).
+
+    kwargs go to ReplaySource.
+    """
+    path = Path(filepath).joinpath(file)
+    if path.suffix == ScanCache.SUFFIX:
+        data, _ = ScanCache.read(path)
+    elif path.suffix == '.tdms':
+        data = ScanCache.from_tdms(path)
+    else:
+        data, _ = ScanCache.from_dat(path, 'base')
+    columns = tuple(c for c in ('time', 'encoder', 'laser', 'load') if c in data)
+    return SerialSource(ReplaySource(data, speed=speed, columns=columns), columns=columns)
+
+
+def run(source, scan=None, value=None, lines=256, idle=None, callback=None, **kwargs):
+    """
+    Feed a StreamScan from a source until it is stopped or done.
+
+    Parameters
+    ----------
+    source : SerialSource
+    scan : StreamScan, optional
+        made from kwargs if not given
+    value : String, optional
+        column that is averaged per position. The default is 'laser' when
+        the source has one, else 'load' (the ToolDAQ feed).
+    idle : float, optional
+        stop when no samples arrived for this many seconds. The default is
+        None, keep polling until the callback stops the run or the source
+        is done.
+    callback : Function, optional
+        called as callback(scan) after every chunk, stops the run when it
+        returns True
+
+    Returns
+    -------
+    scan : StreamScan
+    """
+    if value is None:
+        value = 'laser' if 'laser' in source.columns else 'load'
+    if value not in source.columns:
+        raise KeyError('{} is not one of the source columns {}'.format(value, source.columns))
+    if scan is None:
+        scan = StreamScan(**kwargs)
+    last = _time.monotonic()
+    while True:
+        chunk = source.read(lines)
+        if chunk['encoder'].shape[0]:
+            last = _time.monotonic()
+            scan.feed(chunk['time'], chunk['encoder'], chunk[value], chunk.get('load'))
+            if callback and callback(scan):
+                break
+        elif getattr(source, 'done', False):
+            break
+        elif idle is not None and _time.monotonic() - last > idle:
+            break
+    scan.close()
+    return scan
@@ -0,0 +1,433 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Metamodel prediction.
+
+GPRInference wraps the GaussianProcessRegressor and scalers made by
+ExfoJobj.Make_Meta. The training inputs, alpha_ and kernel parameters are
+taken out of the regressor once, predictions are done in fixed size chunks
+so memory stays bounded for long profiles and large sweeps, and recent
+results are memoized by a hash of the inputs.
+
+QuadMeta is the closed form of the Make_Meta GPR mean: a quadratic
+polynomial in the scaled inputs, stored in a small .npz file that loads
+without sklearn.
+
+MetaCache keeps trained metamodels on disk under a hash of the training
+csv contents, the output column and the training settings, so retraining
+the same model is a file read.
+"""
+import hashlib
+import json
+import pickle
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+
+QUAD_VERSION = 1
+
+
+def _scaler(scaler, n):
+    """Mean and scale of a fitted StandardScaler, identity where unused."""
+    mean = scaler.mean_ if getattr(scaler, 'mean_', None) is not None else np.zeros(n)
+    scale = scaler.scale_ if getattr(scaler, 'scale_', None) is not None else np.ones(n)
+    return np.asarray(mean, dtype=float), np.asarray(scale, dtype=float)
+
+
+def _copy(out):
+    # memoized results are handed out as copies so callers can modify them
+    if isinstance(out, tuple):
+        return tuple(o.copy() for o in out)
+    return out.copy()
+
+
+def dot_kernel(kernel):
+    """
+    (c, sigma_0, exponent) of a c * DotProduct(sigma_0) ** exponent kernel.
+
+    Returns None for any other kernel.
+    """
+    names = [type(k).__name__ for k in (kernel, getattr(kernel, 'k1', None),
+                                        getattr(kernel, 'k2', None))]
+    if names != ['Product', 'ConstantKernel', 'Exponentiation']:
+        return None
+    if type(kernel.k2.kernel).__name__ != 'DotProduct':
+        return None
+    return (float(kernel.k1.constant_value), float(kernel.k2.kernel.sigma_0),
+            float(kernel.k2.exponent))
+
+
+class GPRInference(object):
+    """
+    Chunked, memoized predictions from a fitted GPR.
+
+    Parameters
+    ----------
+    gpr : GaussianProcessRegressor
+        fitted on scaled data
+    scalerX, scalery : StandardScaler
+        scalers the GPR was fitted with
+    chunk : int, optional
+        rows predicted at once. The default is 4096.
+    memo : int, optional
+        number of results kept. The default is 16.
+    """
+
+    def __init__(self, gpr, scalerX, scalery, chunk=4096, memo=16):
+        self.gpr = gpr
+        self.Xt = np.ascontiguousarray(gpr.X_train_, dtype=float)
+        self.alpha = np.asarray(gpr.alpha_, dtype=float).reshape(self.Xt.shape[0], -1)
+        self.kernel = gpr.kernel_
+        self.dot = dot_kernel(self.kernel)
+        self.y_mean = np.asarray(getattr(gpr, '_y_train_mean', 0.), dtype=float).ravel()
+        self.y_std = np.asarray(getattr(gpr, '_y_train_std', 1.), dtype=float).ravel()
+        self.mx, self.sx = _scaler(scalerX, self.Xt.shape[1])
+        self.my, self.sy = _scaler(scalery, self.alpha.shape[1])
+        # the mean of a DotProduct**2 GP is an exact quadratic
+        self.quad = None
+        if self.dot and self.dot[2] == 2:
+            self.quad = QuadMeta.from_gpr(gpr, scalerX, scalery)
+        self.chunk = chunk
+        self.memo = memo
+        self.cache = OrderedDict()
+
+    def fingerprint(self):
+        """Data that determines the predictions, for StageCache."""
+        return (self.Xt, self.alpha, repr(self.kernel), self.y_mean, self.y_std,
+                self.mx, self.sx, self.my, self.sy)
+
+    def _mean(self, Z):
+        # scaled inputs to scaled outputs
+        if self.dot:
+            c, sigma_0, p = self.dot
+            K = Z @ self.Xt.T
+            K += sigma_0**2
+            K **= p
+            K *= c
+        else:
+            K = self.kernel(Z, self.Xt)
+        return K @ self.alpha
+
+    def predict(self, X, return_std=False):
+        """
+        Predict outputs for unscaled inputs X (N x features).
+
+        Returns
+        -------
+        y : np.array
+            (N x 1) unscaled prediction
+        std : np.array
+            (N x 1) predictive std, if return_std
+        """
+        X = np.ascontiguousarray(X, dtype=float)
+        key = hashlib.sha1(X.tobytes() + str((X.shape, return_std)).encode()).hexdigest()
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            return _copy(self.cache[key])
+
+        y = np.empty((X.shape[0], self.alpha.shape[1]))
+        std = np.empty_like(y) if return_std else None
+        for i in range(0, X.shape[0], self.chunk):
+            Xc = X[i:i+self.chunk]
+            if return_std:
+                m, s = self.gpr.predict((Xc - self.mx) / self.sx, return_std=True)
+                y[i:i+self.chunk] = m.reshape(Xc.shape[0], -1)*self.sy + self.my
+                std[i:i+self.chunk] = s.reshape(Xc.shape[0], -1)*self.sy
+            elif self.quad is not None:
+                y[i:i+self.chunk] = self.quad.predict(Xc)
+            else:
+                m = self._mean((Xc - self.mx) / self.sx)
+                y[i:i+self.chunk] = (m*self.y_std + self.y_mean)*self.sy + self.my
+        out = (y, std) if return_std else y
+
+        self.cache[key] = out
+        if len(self.cache) > self.memo:
+            self.cache.popitem(last=False)
+        return _copy(out)
+
+    def sweep(self, X, cols, values):
+        """
+        Predict X with columns cols set to each row of values.
+
+        Parameters
+        ----------
+        X : np.array
+            (N x features) base inputs
+        cols : list
+            columns to replace
+        values : np.array
+            (G x len(cols)) settings
+
+        Returns
+        -------
+        np.array
+            (G x N) predictions, one profile per setting
+        """
+        return _sweep(self.predict, X, cols, values)
+
+
+def _sweep(predict, X, cols, values):
+    values = np.asarray(values, dtype=float).reshape(-1, len(cols))
+    Xs = np.repeat(np.asarray(X, dtype=float)[None], values.shape[0], 0)
+    Xs[:, :, cols] = values[:, None, :]
+    y = predict(Xs.reshape(-1, X.shape[1]))
+    return y[:, 0].reshape(values.shape[0], X.shape[0])
+
+
+def _quad_features(Z):
+    """[1, z, z_i*z_j for i <= j] for each row of Z."""
+    i, j = np.triu_indices(Z.shape[1])
+    return np.hstack((np.ones((Z.shape[0], 1)), Z, Z[:, i]*Z[:, j]))
+
+
+class QuadMeta(object):
+    """
+    Closed form metamodel for a C * DotProduct(sigma_0)**2 GPR.
+
+    The GP mean with that kernel is sum_i alpha_i c (sigma_0**2 + z.x_i)**2,
+    a quadratic polynomial in the scaled inputs z. Its 1 + n + n(n+1)/2
+    coefficients (36 for the 7 inputs) are evaluated as one matrix product
+    and need neither sklearn nor the training data.
+
+    Parameters
+    ----------
+    coef : np.array
+        (features x outputs) coefficients on [1, z, z_i*z_j], output scaling folded in
+    mx, sx : np.array
+        input scaler mean and scale
+    """
+
+    def __init__(self, coef, mx, sx):
+        self.coef = coef
+        self.mx = mx
+        self.sx = sx
+
+    def fingerprint(self):
+        """Data that determines the predictions, for StageCache."""
+        return (self.coef, self.mx, self.sx)
+
+    @classmethod
+    def from_gpr(cls, gpr, scalerX, scalery):
+        """Extract the polynomial from a fitted GPR."""
+        dot = dot_kernel(gpr.kernel_)
+        if dot is None or dot[2] != 2:
+            raise ValueError('quadratic metamodel needs a C * DotProduct**2 kernel')
+        c, sigma_0, _ = dot
+        Xt = np.asarray(gpr.X_train_, dtype=float)
+        alpha = np.asarray(gpr.alpha_, dtype=float).reshape(Xt.shape[0], -1)
+        s2 = sigma_0**2
+
+        const = c*s2**2*alpha.sum(0)
+        lin = 2*c*s2*(Xt.T @ alpha)
+        i, j = np.triu_indices(Xt.shape[1])
+        # off diagonal terms show up twice in z'Qz
+        quad = c*(np.where(i == j, 1, 2)[:, None] * ((Xt[:, i]*Xt[:, j]).T @ alpha))
+        coef = np.vstack((const[None], lin, quad))
+
+        y_mean = np.asarray(getattr(gpr, '_y_train_mean', 0.), dtype=float).ravel()
+        y_std = np.asarray(getattr(gpr, '_y_train_std', 1.), dtype=float).ravel()
+        mx, sx = _scaler(scalerX, Xt.shape[1])
+        my, sy = _scaler(scalery, alpha.shape[1])
+        coef = coef*(y_std*sy)
+        coef[0] += y_mean*sy + my
+        return cls(coef, mx, sx)
+
+    def predict(self, X):
+        """(N x 1) prediction for unscaled inputs X (N x features)."""
+        Z = (np.asarray(X, dtype=float) - self.mx) / self.sx
+        return _quad_features(Z) @ self.coef
+
+    def sweep(self, X, cols, values):
+        """See GPRInference.sweep."""
+        return _sweep(self.predict, X, cols, values)
+
+    def save(self, path):
+        """Write the metamodel to an .npz file."""
+        np.savez(path, version=QUAD_VERSION, coef=self.coef, mx=self.mx, sx=self.sx)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as f:
+            if int(f['version']) != QUAD_VERSION:
+                raise ValueError('unknown quadratic metamodel version')
+            return cls(f['coef'], f['mx'], f['sx'])
+
+
+class SparseGPR(object):
+    """
+    Inducing point (subset of regressors) GP for large training sets.
+
+    Hyperparameters come from an exact GPR fitted on a random subset of
+    n_hyper rows. The mean is then sum_j alpha_j k(x, z_j) over n_inducing
+    rows z_j, with alpha = (alpha*K_mm + K_mn K_nm)^-1 K_mn y accumulated in
+    chunks, so training is O(n m^2) time and O(m^2) memory.
+
+    The fitted object has the X_train_, alpha_ and kernel_ attributes of a
+    GaussianProcessRegressor, so GPRInference and QuadMeta use it as is.
+
+    Parameters
+    ----------
+    kernel : sklearn kernel
+        initial kernel
+    alpha : float, optional
+        noise added to the diagonal. The default is .001.
+    n_inducing : int, optional
+        inducing points. The default is 500.
+    n_hyper : int, optional
+        rows used to fit the kernel hyperparameters. The default is 1000.
+    chunk : int, optional
+        rows per kernel block. The default is 4096.
+    """
+
+    def __init__(self, kernel, alpha=.001, n_inducing=500, n_hyper=1000, chunk=4096,
+                 random_state=0):
+        self.kernel = kernel
+        self.alpha = alpha
+        self.n_inducing = n_inducing
+        self.n_hyper = n_hyper
+        self.chunk = chunk
+        self.random_state = random_state
+
+    def fit(self, X, y):
+        from sklearn.gaussian_process import GaussianProcessRegressor
+        from scipy import linalg
+
+        rng = np.random.default_rng(self.random_state)
+        y = np.asarray(y, dtype=float).reshape(X.shape[0], -1)
+        sub = rng.permutation(X.shape[0])[:self.n_hyper]
+        self.kernel_ = GaussianProcessRegressor(
+            kernel=self.kernel, random_state=self.random_state, n_restarts_optimizer=0,
+            alpha=self.alpha).fit(X[sub], y[sub]).kernel_
+
+        Z = X[rng.permutation(X.shape[0])[:self.n_inducing]]
+        # work in the eigenbasis of K_mm, low rank kernels (DotProduct**2 on 7
+        # inputs has rank 36) leave K_mm singular and K_mn K_nm too badly
+        # conditioned to solve directly
+        lam, U = linalg.eigh(self.kernel_(Z))
+        keep = lam > lam.max()*1E-12
+        self.P_ = U[:, keep]/np.sqrt(lam[keep])
+        S = self.alpha*np.eye(self.P_.shape[1])
+        b = np.zeros((self.P_.shape[1], y.shape[1]))
+        for i in range(0, X.shape[0], self.chunk):
+            F = self.kernel_(X[i:i+self.chunk], Z) @ self.P_
+            S += F.T @ F
+            b += F.T @ y[i:i+self.chunk]
+        self.L_ = linalg.cholesky(S, lower=True)
+        self.X_train_ = Z
+        self.alpha_ = self.P_ @ linalg.cho_solve((self.L_, True), b)
+        self._y_train_mean = np.zeros(1)
+        self._y_train_std = np.ones(1)
+        return self
+
+    def predict(self, X, return_std=False):
+        """Mean (and DTC predictive std) for scaled inputs X."""
+        from scipy import linalg
+
+        Ks = self.kernel_(X, self.X_train_)
+        y = Ks @ self.alpha_
+        if not return_std:
+            return y
+        F = Ks @ self.P_
+        W = linalg.solve_triangular(self.L_, F.T, lower=True)
+        var = self.kernel_.diag(X) - (F**2).sum(1) + self.alpha*(W**2).sum(0)
+        return y, np.sqrt(np.clip(var, 0, None))
+
+
+class MetaCache(object):
+    """
+    Content-addressed store of trained metamodels.
+
+    Each entry is a pickled [scalerX, scalery, gpr] in <directory>/<key>.dat
+    with its training csv, column, settings, size and last use in
+    index.json. Entries unused for longer than max_age seconds are dropped,
+    then the least recently used ones until the store fits max_bytes.
+
+    Parameters
+    ----------
+    directory : Path
+        cache directory, created if missing
+    max_bytes : int, optional
+        size limit of the store. The default is None, no limit.
+    max_age : float, optional
+        seconds an entry is kept since its last use. The default is None, no limit.
+    """
+
+    INDEX = 'index.json'
+
+    def __init__(self, directory, max_bytes=None, max_age=None):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+
+    @staticmethod
+    def key(file, i, **params):
+        """sha1 of the csv contents, the output column and the training settings."""
+        h = hashlib.sha1()
+        with open(file, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                h.update(block)
+        h.update(json.dumps({'i': i, **params}, sort_keys=True, default=str).encode())
+        return h.hexdigest()
+
+    def _index(self):
+        try:
+            with open(self.directory.joinpath(self.INDEX)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_index(self, index):
+        tmp = self.directory.joinpath(self.INDEX + '.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(index, f, indent=1)
+        tmp.replace(self.directory.joinpath(self.INDEX))
+
+    def get(self, key):
+        """[scalerX, scalery, gpr] stored under key, or None."""
+        index = self._index()
+        path = self.directory.joinpath(key + '.dat')
+        if key not in index or not path.exists():
+            return None
+        with open(path, 'rb') as f:
+            model = pickle.load(f)
+        index[key]['used'] = time.time()
+        self._write_index(index)
+        return model
+
+    def put(self, key, model, **info):
+        """Store model ([scalerX, scalery, gpr]) under key, then evict."""
+        path = self.directory.joinpath(key + '.dat')
+        tmp = path.with_suffix('.tmp')
+        with open(tmp, 'wb') as f:
+            pickle.dump(model, f)
+        tmp.replace(path)
+        index = self._index()
+        now = time.time()
+        index[key] = {**info, 'bytes': path.stat().st_size, 'created': now, 'used': now}
+        self._write_index(self.evict(index, keep=key))
+
+    def evict(self, index=None, keep=None):
+        """Drop entries over max_age, then least recently used over max_bytes."""
+        write = index is None
+        if index is None:
+            index = self._index()
+        now = time.time()
+        order = sorted(index, key=lambda k: index[k]['used'])
+        drop = [k for k in order if self.max_age is not None
+                and now - index[k]['used'] > self.max_age and k != keep]
+        total = sum(index[k]['bytes'] for k in order if k not in drop)
+        for k in order:
+            if self.max_bytes is None or total <= self.max_bytes:
+                break
+            if k != keep and k not in drop:
+                drop.append(k)
+                total -= index[k]['bytes']
+        for k in drop:
+            self.directory.joinpath(k + '.dat').unlink(missing_ok=True)
+            del index[k]
+        if write:
+            self._write_index(index)
+        return index
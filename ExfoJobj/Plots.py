@@ -0,0 +1,344 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Plots of ExfoJobj wafers and scans.
+
+Kept apart from ExfoJobj so computing load profiles doesn't import
+matplotlib; the Plot_* and Scan.plot_* methods import this module on
+first use and call these functions with themselves.
+"""
+import matplotlib.pyplot as plt
+import numpy as np
+
+import AxZoom
+import ExfoJobj
+
+
+def plot_wafer(Ex):
+    """Ni and Si thickness with Ni stress and handle tension along the wafer."""
+    color = plt.rcParams['axes.prop_cycle'].by_key()['color'][0]
+    fig, ax1 = plt.subplots(figsize=(8, 4))
+    ax1.plot(Ex.x, Ex.ni*1E6, color=color, linestyle='--', label='Ni Thickness')
+    if hasattr(Ex, 'ex'):
+        ax1.plot(Ex.x, Ex.ex*1E6, color=color, linestyle='-', label='Si Thickness')
+    ax1.tick_params(axis='y', labelcolor=color)
+    # ax1.set_title('Wafer Profile')
+    ax1.set_xlabel('Chuck (mm)')
+    ax1.set_ylabel('Si and Ni Film Thickness (µm)', color=color)
+
+    color = plt.rcParams['axes.prop_cycle'].by_key()['color'][1]
+    ax2 = ax1.twinx()
+    ax2.plot(Ex.x, Ex.S/1E8, color=color, linestyle='-.', label='Ni Stress')
+    ax2.plot(Ex.x, Ex.Load/9.81, color=color, linestyle='-', label='Handle Tension')
+    if hasattr(Ex, 'load'):
+        x, _, y = ExfoJobj.syncstuff(Ex.x, Ex.Load, Ex.load.enc, Ex.load.lod, dm=False)
+        ax2.plot(x, y, color=color, linestyle=':', label='Measured Tension')
+    ax2.tick_params(axis='y', labelcolor=color)
+    ax2.set_ylabel(r'Ni Stress (Pa$\cdot 10^8$) and Handle Tension (Kg)', color=color)
+    # lines, labels = ax1.get_legend_handles_labels()
+    # lines2, labels2 = ax2.get_legend_handles_labels()
+    # ax2.legend(lines + lines2, labels + labels2, loc=0)
+    fig.legend(bbox_to_anchor=(0.03, 0.5, .93, 0.5), loc='upper left', ncol=5, mode="expand", borderaxespad=0., handletextpad=0.1)
+
+    fig.tight_layout(pad=0.1)
+    # ax1.set_xlim(left=0, right=25)
+    ax1.margins(x=0)
+    ax1.set_title('')
+    ax1.set_xlabel('Distance from Stable Crack Start (mm)')
+    return fig, ax1, ax2
+
+
+def plot_batch(Ex):
+    """Check and scan plots of every loaded scan."""
+    scans = [scan for scan in Ex.scans.values() if getattr(Ex, scan, False)]
+    [(plot_check(getattr(Ex, scan)), plt.suptitle(scan)) for scan in scans]
+    [(plot_scans_sub(getattr(Ex, scan)), plt.suptitle(scan)) for scan in scans]
+
+
+# %% Scan plots
+def plot_check(scan):
+    """
+    Plot quick check of enc data vs time to check for jumps and junk.
+
+    Returns
+    -------
+    fig : TYPE
+        DESCRIPTION.
+    ax1 : TYPE
+        DESCRIPTION.
+    ax2 : TYPE
+        DESCRIPTION.
+    """
+    fig, ax1 = plt.subplots()
+    for ii in scan.idx:
+        ax1.scatter(scan.idx[:, 0], scan.enc[scan.idx[:, 0]], marker='x')
+    for ii in scan.idx:
+        ax1.scatter(scan.idx[:, 1]-1, scan.enc[scan.idx[:, 1]-1], marker='x', color='blue')
+    ax1.plot(scan.enc)
+    plt.title('Check Start and Stop')
+    plt.xlabel('time steps')
+    plt.ylabel('encoder distance')
+
+    ax2 = ax1.twinx()
+    c = plt.rcParams['axes.prop_cycle'].by_key()['color'][2]
+    ax2.plot(scan.g/scan.g.max(), color=c)
+    plt.ylabel('encoder gradient')
+    # check errors
+    fx = np.array(scan.idx[1:][::2, :].mean(axis=1), dtype='int')
+    bx = np.array(scan.idx[0:][::2, :].mean(axis=1), dtype='int')
+    # median or mean?
+    ax2.plot(fx, scan.fsmean)
+    ax2.plot(bx, scan.bsmean)
+    return fig, ax1, ax2
+
+
+def plot_scans(scan):
+    """
+    Plot forwards and backwards scans calculated from idx.
+
+    Returns
+    -------
+    fig2 : TYPE
+        DESCRIPTION.
+    ax2 : TYPE
+        DESCRIPTION.
+    fig3 : TYPE
+        DESCRIPTION.
+    ax3 : TYPE
+        DESCRIPTION.
+
+    """
+    fig2, ax2 = plt.subplots()
+    # grab every other scan from idices
+    # forward
+    for ii in scan.idx[0:][::2, :]:
+        ef = scan.enc[range(*ii.tolist())]
+        lf = scan.lzr[range(*ii.tolist())]
+        ax2.plot(ef, lf)
+    ax2.set_title('Forward Chuck Scans')
+    ax2.set_xlabel('Chuck (mm)')
+    ax2.set_ylabel('Laser Distance (mm)')
+
+    fig3, ax3 = plt.subplots()
+    for ii in scan.idx[1:][::2, :]:
+        eb = scan.enc[range(*ii.tolist())]
+        lb = scan.lzr[range(*ii.tolist())]
+        ax3.plot(eb, lb)
+    ax3.set_title('Backward Chuck Scans')
+    ax3.set_xlabel('Chuck (mm)')
+    ax3.set_ylabel('Laser Distance (mm)')
+    return fig2, ax2, fig3, ax3
+
+
+def plot_scans2(scan, trim=np.s_[:]):
+    """
+    Plot forwards and backwards scans.
+
+    Parameters
+    ----------
+    trim : TYPE, optional
+        DESCRIPTION. The default is np.s_[50:-500].
+
+    Returns
+    -------
+    fig2 : TYPE
+        DESCRIPTION.
+    ax2 : TYPE
+        DESCRIPTION.
+    fig3 : TYPE
+        DESCRIPTION.
+    ax3 : TYPE
+        DESCRIPTION.
+
+    """
+    fig2, ax2 = plt.subplots()
+    # grab every other scan from idices using attributes
+    # forward
+    for ii, jj in zip(scan.eforward, scan.lforward):
+        plt.plot(ii[trim], jj[trim])
+    ax2.set_title('Forward Chuck Scans')
+    ax2.set_xlabel('Chuck (mm)')
+    ax2.set_ylabel('Laser Distance (mm)')
+
+    fig3, ax3 = plt.subplots()
+    for ii, jj in zip(scan.ebackward, scan.lbackward):
+        plt.plot(ii[trim], jj[trim])
+    ax3.set_title('Backward Chuck Scans')
+    ax3.set_xlabel('Chuck (mm)')
+    ax3.set_ylabel('Laser Distance (mm)')
+    return fig2, ax2, fig3, ax3
+
+
+def plot_scans_sub(scan, trim=np.s_[:]):
+    fig, (ax1, ax2) = plt.subplots(2, 1, sharey=True, sharex=True)
+    for ii, jj in zip(scan.eforward, scan.lforward):
+        ax1.plot(ii[trim], jj[trim])
+    ax1.set_title('Forward Chuck Scans')
+    ax1.set_xlabel('Chuck (mm)')
+    # ax1.set_ylabel('Laser Distance (mm)')
+
+    for ii, jj in zip(scan.ebackward, scan.lbackward):
+        ax2.plot(ii[trim], jj[trim])
+    ax2.set_title('Backward Chuck Scans')
+    ax2.set_xlabel('Chuck (mm)')
+    # ax2.set_ylabel('Laser Distance (mm)')
+
+    AxZoom.suplabel(ax1, 'Laser Distance (mm)', labelpad=10)
+    return ax1, ax2, fig
+
+
+def plot_mean(scan, trim=np.s_[:]):
+    """
+    Plot the means of F-B scans with 1 std window.
+
+    Parameters
+    ----------
+    trim : TYPE, optional
+        DESCRIPTION. The default is np.s_[50:-500].
+
+    Returns
+    -------
+    fig : TYPE
+        DESCRIPTION.
+    ax : TYPE
+        DESCRIPTION.
+
+    """
+    def mean_plot(means):
+        means = [ii[trim] for ii in means]
+        mn, std, n, SEM, encm = means
+        fig, ax = plt.subplots()
+        # ax.fill_between(x, mn - SEM, mn + SEM, alpha=0.2)
+        ax.fill_between(encm, mn - std, mn + std, alpha=0.2)
+        ax.plot(encm, mn)
+        return fig, ax
+
+    fig, ax = mean_plot(scan.fmeans)
+    ax.set_title('Forward Scan Mean')
+    ax.set_xlabel('Chuck (mm)')
+    ax.set_ylabel('Laser Distance (mm)')
+
+    fig2, ax2 = mean_plot(scan.bmeans)
+    ax2.set_title('Backward Scan Mean')
+    ax2.set_xlabel('Chuck (mm)')
+    ax2.set_ylabel('Laser Distance (mm)')
+
+
+def plot_mean_sub(scan, trim=np.s_[:]):
+    def mean_plot(means, ax):
+        means = [ii[trim] for ii in means]
+        mn, std, n, SEM, encm = means
+        ax.fill_between(encm, mn - std, mn + std, alpha=0.2)
+        ax.plot(encm, mn)
+
+    fig, (ax1, ax2) = plt.subplots(2, 1, sharey=True, sharex=True)
+    mean_plot(scan.fmeans, ax1)
+    mean_plot(scan.bmeans, ax2)
+    # fig.tight_layout()
+    ax1.set_title('Scan Means')
+    # fig.suptitle('Scan Means')
+    # ax1.set_title('Forward')
+    # ax2.set_title('Backward')
+    AxZoom.suplabel(ax1, 'Laser Distance (mm)', labelpad=10)
+    ax1.set_ylabel('Forward')
+    ax2.set_ylabel('Backward')
+    ax2.set_xlabel('Chuck (mm)')
+    return ax1, ax2, fig
+
+
+def plot_error_byp(scan, m=2, bins=50):
+    """
+    Plot histograms of error from mean for each unique encoder position for F-B and combined.
+    Plot error to mean for each unique encoder value.
+
+    Trim outliers for more legible axis.
+
+    Parameters
+    ----------
+    m : int, optional
+        exclude outliers m standard deviations out. The default is 2.
+    bins : int, optional
+        Histogram bins. The default is 500.
+
+    Returns
+    -------
+    ax and fig handles
+        forward, backwards, and combined.
+
+    """
+    def reject_outliers(data, m=m):
+        return data[abs(data - np.mean(data)) < m * np.std(data)]
+
+    fig1, (ax1, ax2) = plt.subplots(2, 1, sharey=True, sharex=True, constrained_layout=True)
+    # fig1.tight_layout()
+    # fig1, ax1 = plt.subplots()
+    ax1.hist(reject_outliers(scan.error_byp_f * 1000), bins)
+    ax1.set_title('Forward Height Error by Position')
+    ax1.set_ylabel('Counts')
+    # ax1.set_xlabel('Laser Distance Error (µm)')
+
+    # fig2, ax2 = plt.subplots()
+    ax2.hist(reject_outliers(scan.error_byp_b * 1000), bins)
+    ax2.set_title('Backward Height Error by Position')
+    ax2.set_ylabel('Counts')
+    ax2.set_xlabel('Laser Distance Error (µm)')
+
+    fig3, ax3 = plt.subplots()
+    x = np.concatenate((scan.error_byp_f, scan.error_byp_b)) * 1000
+    ax3.hist(reject_outliers(x[~np.equal(x, 0)]), bins)
+    ax3.set_title('Combined F-B Height Error by Position')
+    ax3.set_ylabel('Counts')
+    ax3.set_xlabel('Laser Distance Error (µm)')
+    return ax1, fig1, ax2, ax3, fig3
+
+
+def plot_scan_error(scan):
+    """Plot median error and std for each scan."""
+    fig, ax = plt.subplots()
+    ax.plot(scan.fsmed, label='Forward Median')
+    ax.plot(scan.bsmed, label='Backward Median')
+    ax.legend()
+    ax.set_title('Per Scan Error')
+    ax.set_xlabel('Scan')
+    ax.set_ylabel('Laser Median Error (µm)')
+
+    ax2 = ax.twinx()
+    ax2.plot(scan.fsstd, label='Forward Std', linestyle='--')
+    ax2.plot(scan.bsstd, label='Backward Std', linestyle='--')
+    ax2.set_ylabel('Laser Error Std (µm)')
+    ax2.legend()
+    # fig.legend(loc="upper right", bbox_to_anchor=(1,1), bbox_transform=ax.transAxes)
+    return fig, ax, ax2
+
+
+def plot_densities(scan):
+    """Plot freq domain stuff."""
+    # plt.csd(mn, mnb, NFFT = 1024, detrend='mean')
+    # plt.csd(mn, mnb, NFFT = 64, Fs = 1, noverlap = 32, pad_to=150, detrend='mean')
+    fig, ax = plt.subplots()
+    ax.csd(scan.fmeans[0], scan.bmeans[0],
+           NFFT=129, Fs=2, noverlap=12, pad_to=900, detrend='mean')
+    ax.set_xlabel('Normalized Frequency')
+    ax.set_xlabel('Combined F-B Spectral Density')
+    ax.set_title('CSD')
+
+    # plt.set_cmap('inferno')
+    # fig2, ax2 = plt.subplots()
+    # ax2.specgram(scan.fmeans[0],
+    #              NFFT=65, Fs=1, noverlap=32, detrend='mean', pad_to=200, mode='magnitude')
+    # t = signal.butter(10, .0005, btype='lowpass', output='sos')
+    # tt = signal.sosfilt(t, scan.fmeans[0]-scan.fmeans[0].mean())
+    # ttb = signal.sosfilt(t, scan.bmeans[0]-scan.bmeans[0].mean())
+    # fig3, ax3 = plt.subplots()
+    # plt.plot(tt)
+    # plt.plot(ttb)
+
+
+def plot_all(scan):
+    """Run all the plots."""
+    plot_check(scan)
+    plot_scans2(scan)
+    plot_error_byp(scan, bins=50)
+    plot_mean(scan)
+    plot_scan_error(scan)
+    # plot_densities(scan)
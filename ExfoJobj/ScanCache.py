@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Columnar scan cache.
+
+A cache is a directory next to the raw scan, <name>.npc/, holding one .npy
+file per channel plus header.json with the format version, the channel
+lengths and the size/mtime/sha1 of the source file it was built from. The
+channels can be memory-mapped, so a cached scan is never read in full just
+to be opened, and a cache whose source has changed is rebuilt.
+
+Old pickled .dat scans are read once by from_dat and written back as a
+cache, so they keep working as sources.
+"""
+import hashlib
+import json
+import pickle
+from collections.abc import Mapping
+from pathlib import Path
+
+import numpy as np
+
+VERSION = 1
+SUFFIX = '.npc'
+HEADER = 'header.json'
+CHANNELS = {'time': 'Untitled',
+            'encoder': 'encoder',
+            'laser': 'laser',
+            'load': 'load'}
+
+
+def cache_path(filepath, name):
+    """Path of the cache for scan name (no suffix) in filepath."""
+    return Path(filepath).joinpath(name + SUFFIX)
+
+
+def source_stamp(source, digest=True):
+    """Size, mtime and sha1 of the source file."""
+    source = Path(source)
+    st = source.stat()
+    stamp = {'name': source.name, 'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+    if digest:
+        h = hashlib.sha1()
+        with open(source, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                h.update(block)
+        stamp['sha1'] = h.hexdigest()
+    return stamp
+
+
+def read_header(cache):
+    """Header of a cache or None if there is no readable cache."""
+    try:
+        with open(Path(cache).joinpath(HEADER)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def is_fresh(cache, source):
+    """
+    Check that a cache exists, has the current version and matches source.
+
+    Size and mtime are compared first; if only the mtime moved, the sha1
+    decides and the header is updated so the next check is cheap again.
+    """
+    header = read_header(cache)
+    if header is None or header.get('version') != VERSION:
+        return False
+    old = header.get('source', {})
+    new = source_stamp(source, digest=False)
+    if old.get('name') != new['name'] or old.get('size') != new['size']:
+        return False
+    if old.get('mtime_ns') == new['mtime_ns']:
+        return True
+    new = source_stamp(source)
+    if old.get('sha1') != new['sha1']:
+        return False
+    header['source'] = new
+    _write_header(cache, header)
+    return True
+
+
+def write(cache, channels, source=None, trim=False):
+    """
+    Write channels (dict of name: array) to cache.
+
+    Parameters
+    ----------
+    cache : Path
+        /path/to/name.npc
+    channels : dict
+        channel name to 1-D array
+    source : Path, optional
+        file the channels were read from, stamped into the header
+    trim : array or slice, optional
+        scans to skip, kept with the cache (legacy .trim.dat)
+    """
+    cache = Path(cache)
+    cache.mkdir(parents=True, exist_ok=True)
+    header = {'version': VERSION,
+              'channels': {},
+              'source': source_stamp(source) if source else {}}
+    for name, data in channels.items():
+        data = np.ascontiguousarray(data, dtype=np.float64)
+        np.save(cache.joinpath(name + '.npy'), data)
+        header['channels'][name] = data.shape[0]
+    if isinstance(trim, slice):
+        header['trim'] = {'slice': [trim.start, trim.stop, trim.step]}
+    elif np.asarray(trim).any():
+        header['trim'] = {'index': np.asarray(trim).tolist()}
+    _write_header(cache, header)
+
+
+def _write_header(cache, header):
+    # header goes last and is swapped in whole, a cache without one is invalid
+    tmp = Path(cache).joinpath(HEADER + '.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(header, f, indent=1)
+    tmp.replace(Path(cache).joinpath(HEADER))
+
+
+def read(cache, channels=None, mmap=True):
+    """
+    Read a cache.
+
+    Parameters
+    ----------
+    cache : Path
+        /path/to/name.npc
+    channels : list, optional
+        channels to open. The default is all of them.
+    mmap : bool, optional
+        memory-map the channels instead of reading them. The default is True.
+
+    Returns
+    -------
+    data : dict
+        channel name to array
+    trim : array, slice or False
+        scans to skip stored with the cache
+    """
+    header = read_header(cache)
+    if header is None or header.get('version') != VERSION:
+        raise ValueError('no valid scan cache at {}'.format(cache))
+    if channels is None:
+        channels = [*header['channels']]
+    data = {name: np.load(Path(cache).joinpath(name + '.npy'),
+                          mmap_mode='r' if mmap else None)
+            for name in channels if name in header['channels']}
+    trim = header.get('trim', {})
+    if 'slice' in trim:
+        trim = slice(*trim['slice'])
+    elif 'index' in trim:
+        trim = np.array(trim['index'])
+    else:
+        trim = False
+    return data, trim
+
+
+class TdmsChannels(Mapping):
+    """
+    Read-on-access view of the scan channels of a LabVIEW tdms file.
+
+    The file is opened in streaming mode, so only its metadata is read up
+    front and each channel is read from disk when it is looked up. Nothing
+    is kept after a lookup; hold on to the returned array instead of
+    looking the channel up again. Reading every channel this way is slower
+    than a full read, use it when only some channels are needed.
+    """
+
+    def __init__(self, path):
+        from nptdms import TdmsFile
+        self.file = TdmsFile.open(Path(path))
+        self.group = self.file['Untitled']
+        self.names = [name for name, channel in CHANNELS.items() if channel in self.group]
+
+    def __getitem__(self, name):
+        if name not in self.names:
+            raise KeyError(name)
+        return self.group[CHANNELS[name]].read_data()
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def from_tdms(path, lazy=False):
+    """
+    Read the scan channels of a LabVIEW tdms file.
+
+    With lazy=True a TdmsChannels view is returned and channels are only
+    read when they are looked up, otherwise all channels are read into a
+    dict.
+    """
+    channels = TdmsChannels(path)
+    if lazy:
+        return channels
+    with channels:
+        return dict(channels.items())
+
+
+def from_dat(path, scan):
+    """
+    Read a legacy pickled scan.
+
+    Layouts are [time, enc, lzr], [time, lod, enc, lzr] for load scans and
+    [time, enc, lzr, trim] for .trim.dat files.
+    """
+    with open(path, 'rb') as f:
+        dat = pickle.load(f)
+    trim = False
+    if Path(path).name.endswith('.trim.dat'):
+        time, enc, lzr, trim = dat
+        data = {'time': time, 'encoder': enc, 'laser': lzr}
+    elif scan == 'load':
+        time, lod, enc, lzr = dat
+        data = {'time': time, 'encoder': enc, 'laser': lzr, 'load': lod}
+    else:
+        time, enc, lzr = dat
+        data = {'time': time, 'encoder': enc, 'laser': lzr}
+    return data, trim
+
+
+def build(cache, source, scan):
+    """Build cache from a tdms or legacy .dat source."""
+    if Path(source).suffix == '.tdms':
+        write(cache, from_tdms(source), source=source)
+    else:
+        data, trim = from_dat(source, scan)
+        write(cache, data, source=source, trim=trim)
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Pipeline stage memoization.
+
+Each ExfoJobj stage (Load_Batch, Wafer_Sync, Wafer_Make, Get_Stress,
+Make_Load) is keyed by a fingerprint of its parameters and of the data it
+reads, and the attributes it sets are stored under that key. A stage whose
+inputs and parameters are unchanged restores its outputs instead of
+running, so after changing one parameter only the stages downstream of it
+recompute: a stage whose inputs come out bit for bit the same is a hit
+again.
+
+Results live in memory (least recently used are dropped past size) and,
+with a directory, are also pickled to disk so they survive the session.
+"""
+import functools
+import hashlib
+import inspect
+import pickle
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+
+
+def _update(h, obj):
+    if isinstance(obj, np.ndarray):
+        h.update(b'a' + str((obj.dtype.str, obj.shape)).encode())
+        h.update(np.ascontiguousarray(obj).tobytes())
+    elif obj is None or isinstance(obj, (bool, int, float, complex, str, bytes, np.generic)):
+        h.update(repr(obj).encode())
+    elif isinstance(obj, (list, tuple)):
+        h.update(b'l' + str(len(obj)).encode())
+        for o in obj:
+            _update(h, o)
+    elif isinstance(obj, dict):
+        h.update(b'd' + str(len(obj)).encode())
+        for k in sorted(obj, key=repr):
+            _update(h, k)
+            _update(h, obj[k])
+    elif isinstance(obj, slice):
+        _update(h, ('slice', obj.start, obj.stop, obj.step))
+    elif isinstance(obj, Path):
+        _update(h, ('path', str(obj)))
+    elif hasattr(obj, 'fingerprint'):
+        _update(h, obj.fingerprint())
+    elif inspect.isfunction(obj):
+        # filters made by exFilter(size) etc. differ by their closure
+        _update(h, (obj.__module__, obj.__qualname__))
+        for cell in obj.__closure__ or ():
+            _update(h, cell.cell_contents)
+    else:
+        # other objects (the ExfoJobj an sFilter reads from) count by type,
+        # the data they provide has to be among the stage inputs
+        _update(h, ('object', type(obj).__module__, type(obj).__qualname__))
+
+
+def fingerprint(*objs):
+    """sha1 of arrays, numbers, strings, containers and filter functions."""
+    h = hashlib.sha1()
+    _update(h, objs)
+    return h.hexdigest()
+
+
+class StageCache(object):
+    """
+    Stage results by key, in memory and optionally on disk.
+
+    Parameters
+    ----------
+    directory : Path, optional
+        disk tier, one pickle per result. The default is None, memory only.
+    size : int, optional
+        results kept in memory. The default is 32.
+    """
+
+    def __init__(self, directory=None, size=32):
+        self.directory = Path(directory) if directory is not None else None
+        if self.directory is not None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+        self.size = size
+        self.memory = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Stored outputs (attribute name to value) or None."""
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            self.hits += 1
+            return self.memory[key]
+        if self.directory is not None:
+            path = self.directory.joinpath(key + '.pkl')
+            if path.exists():
+                with open(path, 'rb') as f:
+                    out = pickle.load(f)
+                self._keep(key, out)
+                self.hits += 1
+                return out
+        self.misses += 1
+        return None
+
+    def put(self, key, out):
+        self._keep(key, out)
+        if self.directory is not None:
+            path = self.directory.joinpath(key + '.pkl')
+            tmp = path.with_suffix('.tmp')
+            with open(tmp, 'wb') as f:
+                pickle.dump(out, f)
+            tmp.replace(path)
+
+    def _keep(self, key, out):
+        self.memory[key] = out
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.size:
+            self.memory.popitem(last=False)
+
+    def clear(self):
+        self.memory.clear()
+        if self.directory is not None:
+            for path in self.directory.glob('*.pkl'):
+                path.unlink()
+
+
+def _get(obj, name):
+    for part in name.split('.'):
+        obj = getattr(obj, part, None)
+    return obj
+
+
+def stage(inputs=(), outputs=(), ignore=()):
+    """
+    Memoize an ExfoJobj stage method through obj.stages.
+
+    Does nothing unless obj.stages is a StageCache.
+
+    Parameters
+    ----------
+    inputs : tuple
+        attribute names (dotted for nested) the stage reads, or functions
+        f(obj, params) returning input data
+    outputs : tuple or function
+        attribute names the stage sets, or f(obj) returning them
+    ignore : tuple
+        parameters that don't change the result (worker counts)
+    """
+    def wrap(method):
+        sig = inspect.signature(method)
+
+        @functools.wraps(method)
+        def run(self, *args, **kwargs):
+            cache = getattr(self, 'stages', None)
+            if cache is None:
+                return method(self, *args, **kwargs)
+            bound = sig.bind(self, *args, **kwargs)
+            bound.apply_defaults()
+            params = {k: v for k, v in [*bound.arguments.items()][1:] if k not in ignore}
+            data = [i(self, params) if callable(i) else _get(self, i) for i in inputs]
+            key = fingerprint(method.__name__, params, data)
+            out = cache.get(key)
+            if out is not None:
+                for name, value in out.items():
+                    setattr(self, name, value)
+                return None
+            result = method(self, *args, **kwargs)
+            names = outputs(self) if callable(outputs) else outputs
+            cache.put(key, {name: getattr(self, name) for name in names if hasattr(self, name)})
+            return result
+        return run
+    return wrap
@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tailing reader for tdms files that are still being written.
+
+LabVIEW appends a tdms file segment by segment during a scan, and the last
+segment keeps growing until it is closed. TdmsTail keeps its place in the
+file: each read parses only the segments (and the part of the open
+segment) added since the last one and returns the new channel samples,
+so a live Scan can be updated while the tool is running.
+
+Only what the scan VI writes is handled: numeric channels, contiguous or
+interleaved, little or big endian. DAQmx raw data is not.
+"""
+import struct
+import time as _time
+from pathlib import Path
+
+import numpy as np
+
+import LiveScan
+import ScanCache
+
+LEAD_IN = 28
+# ToC flags
+META_DATA = 1 << 1
+NEW_OBJ_LIST = 1 << 2
+RAW_DATA = 1 << 3
+INTERLEAVED = 1 << 5
+BIG_ENDIAN = 1 << 6
+# segment still being written
+OPEN_SEGMENT = 0xFFFFFFFFFFFFFFFF
+
+DTYPES = {1: 'i1', 2: 'i2', 3: 'i4', 4: 'i8', 5: 'u1', 6: 'u2', 7: 'u4', 8: 'u8',
+          9: 'f4', 10: 'f8', 0x19: 'f4', 0x1A: 'f8', 0x21: 'u1'}
+# property value sizes, strings (0x20) are length prefixed
+SIZES = {**{k: np.dtype(v).itemsize for k, v in DTYPES.items()}, 0x44: 16}
+
+
+class TdmsTail(object):
+    """
+    Incremental reader of a growing tdms file.
+
+    Parameters
+    ----------
+    path : Path
+        tdms file, does not have to exist yet
+    group : String, optional
+        group holding the scan channels. The default is 'Untitled'.
+
+    Notes
+    -----
+    Channels are returned under the ScanCache names (time, encoder, laser,
+    load). Samples of a chunk are returned once the whole chunk is on disk.
+    """
+
+    def __init__(self, path, group='Untitled'):
+        self.path = Path(path)
+        self.group = group
+        self.names = {"/'{}'/'{}'".format(group, channel): name
+                      for name, channel in ScanCache.CHANNELS.items()}
+        # object path: [dtype code, values per chunk], in segment order
+        self.objects = {}
+        self.pos = 0
+        self.segment = None
+        self.segments = 0
+
+    def read(self):
+        """
+        New samples since the last read.
+
+        Returns
+        -------
+        dict
+            channel name to array, empty arrays when nothing new is complete
+        """
+        out = {name: [] for name in self.names.values()}
+        if not self.path.exists():
+            return self._join(out)
+        with open(self.path, 'rb') as f:
+            size = f.seek(0, 2)
+            while True:
+                if self.segment is None and not self._next_segment(f, size):
+                    break
+                self._read_data(f, size, out)
+                seg = self.segment
+                if seg['end'] is None or seg['pos'] < seg['end']:
+                    break
+                self.pos = seg['end']
+                self.segment = None
+        return self._join(out)
+
+    def _join(self, out):
+        return {name: np.concatenate(v) if v else np.empty(0) for name, v in out.items()}
+
+    def _next_segment(self, f, size):
+        """Parse the lead-in and metadata at self.pos, False if not all there yet."""
+        if size - self.pos < LEAD_IN:
+            return False
+        f.seek(self.pos)
+        tag, toc, _, nxt, raw = struct.unpack('<4sIIQQ', f.read(LEAD_IN))
+        if tag != b'TDSm':
+            raise ValueError('not a tdms segment at {} in {}'.format(self.pos, self.path))
+        start = self.pos + LEAD_IN
+        if size < start + raw:
+            return False
+        meta = f.read(raw)
+        endian = '>' if toc & BIG_ENDIAN else '<'
+        if toc & NEW_OBJ_LIST:
+            previous = self.objects
+            self.objects = {}
+        else:
+            previous = {}
+        if toc & META_DATA:
+            self._parse_meta(meta, endian, previous)
+        chunk = [(p, np.dtype(endian + DTYPES[c]), n) for p, (c, n) in self.objects.items()
+                 if c is not None and n]
+        self.segment = {
+            'start': self.pos,
+            'end': None if nxt == OPEN_SEGMENT else start + nxt,
+            'pos': start + raw,
+            'chunk': chunk,
+            'size': sum(dt.itemsize*n for _, dt, n in chunk),
+            'interleaved': bool(toc & INTERLEAVED),
+            'raw': bool(toc & RAW_DATA)}
+        self.segments += 1
+        return True
+
+    def _parse_meta(self, meta, endian, previous):
+        u32 = struct.Struct(endian + 'I')
+        u64 = struct.Struct(endian + 'Q')
+        i = 0
+
+        def read(s):
+            nonlocal i
+            value = s.unpack_from(meta, i)[0]
+            i += s.size
+            return value
+
+        def string():
+            nonlocal i
+            n = read(u32)
+            i += n
+            return meta[i-n:i].decode('utf-8', 'replace')
+
+        for _ in range(read(u32)):
+            path = string()
+            index = read(u32)
+            if index == 0xFFFFFFFF:
+                self.objects.setdefault(path, [None, 0])
+            elif index == 0:
+                # same layout as this object had in the previous segment
+                self.objects[path] = [*(self.objects.get(path) or previous[path])]
+            elif index in (0x69120000, 0x69130000):
+                raise ValueError('DAQmx raw data is not supported')
+            else:
+                code = read(u32)
+                read(u32)
+                n = read(u64)
+                if code not in DTYPES:
+                    raise ValueError('tdms data type {:#x} is not supported'.format(code))
+                # index length counts itself, strings add a byte count
+                i += index - 20
+                self.objects[path] = [code, n]
+            for _ in range(read(u32)):
+                string()
+                code = read(u32)
+                if code == 0x20:
+                    string()
+                else:
+                    i += SIZES[code]
+
+    def _read_data(self, f, size, out):
+        """Read the complete chunks of the current segment that are on disk."""
+        seg = self.segment
+        if seg['end'] is None:
+            # reread the lead-in, LabVIEW fills in the length when it closes the segment
+            f.seek(seg['start'] + 12)
+            nxt = struct.unpack('<Q', f.read(8))[0]
+            if nxt != OPEN_SEGMENT:
+                seg['end'] = seg['start'] + LEAD_IN + nxt
+        if not seg['raw'] or not seg['size']:
+            seg['pos'] = seg['end'] if seg['end'] is not None else seg['pos']
+            return
+        end = min(size, seg['end']) if seg['end'] is not None else size
+        chunks = (end - seg['pos']) // seg['size']
+        if chunks:
+            f.seek(seg['pos'])
+            self._unpack(f.read(chunks*seg['size']), out)
+            seg['pos'] += chunks*seg['size']
+        if seg['end'] is not None and size >= seg['end'] and seg['pos'] < seg['end']:
+            # closed on a short last chunk, read as nptdms does: each channel
+            # gets its share of the remainder, in turn
+            f.seek(seg['pos'])
+            buf = f.read(seg['end'] - seg['pos'])
+            seg['pos'] = seg['end']
+            if seg['interleaved']:
+                row = sum(dt.itemsize for _, dt, _ in seg['chunk'])
+                self._unpack(buf[:len(buf)//row*row], out)
+                return
+            i = 0
+            for p, dt, n in seg['chunk']:
+                k = n*len(buf)//seg['size']
+                if p in self.names:
+                    out[self.names[p]].append(np.frombuffer(buf, dt, k, i).astype(float))
+                i += k*dt.itemsize
+
+    def _unpack(self, buf, out):
+        """Channel samples of whole chunks (whole rows when interleaved)."""
+        seg = self.segment
+        if seg['interleaved']:
+            # one row per sample across all channels
+            dtype = np.dtype([(p, dt) for p, dt, _ in seg['chunk']])
+            rows = np.frombuffer(buf, dtype=dtype)
+            for p, _, _ in seg['chunk']:
+                if p in self.names:
+                    out[self.names[p]].append(rows[p].astype(float))
+            return
+        # contiguous, each chunk is every channel's n values in turn
+        fields = [(p, dt, (n,)) for p, dt, n in seg['chunk']]
+        blocks = np.frombuffer(buf, dtype=np.dtype(fields))
+        for p, _, _ in seg['chunk']:
+            if p in self.names:
+                out[self.names[p]].append(blocks[p].ravel().astype(float))
+
+
+def follow(path, scan=None, value='laser', poll=.5, idle=10, callback=None, **kwargs):
+    """
+    Feed a StreamScan from a tdms file while it is being written.
+
+    Parameters
+    ----------
+    path : Path
+        tdms file
+    scan : LiveScan.StreamScan, optional
+        made from kwargs if not given
+    value : String, optional
+        channel that is averaged per position. The default is 'laser'.
+    poll : float, optional
+        seconds between reads. The default is .5.
+    idle : float, optional
+        stop when the file hasn't grown for this many seconds. The default is 10.
+    callback : Function, optional
+        called as callback(scan) after every read with new samples, stops
+        following when it returns True
+
+    Returns
+    -------
+    scan : LiveScan.StreamScan
+    """
+    if scan is None:
+        scan = LiveScan.StreamScan(**kwargs)
+    tail = TdmsTail(path)
+    # samples of channels that ran ahead of the others, fed with the next read
+    carry = {}
+    has_load = False
+    last = _time.monotonic()
+    while True:
+        data = tail.read()
+        data = {k: np.concatenate((carry[k], v)) if k in carry else v for k, v in data.items()}
+        has_load = has_load or data['load'].shape[0] > 0
+        used = ['time', 'encoder', value] + (['load'] if has_load else [])
+        n = min(data[k].shape[0] for k in used)
+        carry = {k: v[n:] for k, v in data.items()}
+        if n:
+            last = _time.monotonic()
+            load = data['load'][:n] if 'load' in used else None
+            scan.feed(data['time'][:n], data['encoder'][:n], data[value][:n], load)
+            if callback and callback(scan):
+                break
+        elif _time.monotonic() - last > idle:
+            break
+        else:
+            _time.sleep(poll)
+    scan.close()
+    return scan
@@ -4,6 +4,7 @@ ExfoJobj Basic Example
 
 # import everything
 import ExfoJobj
+import Instrument
 import matplotlib.pyplot as plt
 
 # make cool plots
@@ -15,16 +16,25 @@ plt.rc('font', size=14)
 plt.rc('lines', linewidth=2)
 plt.rc('legend', fontsize=12)
 plt.rc('legend', labelspacing=.1)
+# show progress messages, batch runs stay quiet without this
+Instrument.console()
+
 # %% Example
 
 # Initialize Object
 Ex = ExfoJobj.ExfoJobj('example')
-# Generate metamodel
-# Ex.Make_Meta('data/ansys_dat_122.csv')
+# Generate metamodel, or read it from the cache if this csv was trained before
+# Ex.Make_Meta('data/ansys_dat_122.csv', cache='data/meta_cache')
 # Save metamodel for faster loading later
 # Ex.Pickle_Meta('data/', 'example_meta')
+# or only its closed form, loads without sklearn
+# Ex.Export_Meta('data/', 'example_quad')
+# Ex.Import_Meta('data/', 'example_quad')
 Ex.Load_Meta('data/', 'example_meta')
 
+# Rerun only the stages downstream of a changed parameter (optionally on disk)
+# Ex.Cache_Stages('data/stage_cache')
+
 # set limits for gage block size
 llim = 40
 ulim = 65
@@ -0,0 +1,6 @@
+# -*- coding: utf-8 -*-
+"""The modules import each other flat, as when run from ExfoJobj/."""
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
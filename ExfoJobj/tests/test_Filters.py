@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Filters against signal.medfilt and per pass filtering."""
+import numpy as np
+import pytest
+from scipy import signal
+
+import Filters
+
+
+@pytest.mark.parametrize('shape, axis, size', [((7, 300), -1, 21), ((7, 300), 0, 5),
+                                               ((3, 4, 50), 1, 9), ((4, 200), 1, 65)])
+def test_median_stack(shape, axis, size):
+    x = np.random.default_rng(0).normal(size=shape)
+    lines = np.moveaxis(x, axis, -1)
+    ref = np.empty_like(lines)
+    for i in np.ndindex(lines.shape[:-1]):
+        ref[i] = signal.medfilt(lines[i], size)
+    np.testing.assert_array_equal(Filters.median(x, size, axis), np.moveaxis(ref, -1, axis))
+
+
+def test_batch_matches_passes():
+    rng = np.random.default_rng(1)
+    lengths = np.array([500, 320, 410])
+    stack = rng.normal(size=(3, 500))
+    for filt in (Filters.Median(21), Filters.MedianMean(11, 21)):
+        out = filt.batch(stack, lengths)
+        for i, n in enumerate(lengths):
+            np.testing.assert_allclose(out[i, :n], filt(stack[i, :n]), atol=1E-12)
+            assert not out[i, n:].any()
+
+
+def test_filter_is_abstract():
+    with pytest.raises(TypeError):
+        Filters.Filter()
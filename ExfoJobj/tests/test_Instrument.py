@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Instrument.timer memory peaks."""
+import threading
+import time
+import tracemalloc
+
+import numpy as np
+
+import Instrument
+
+MB = 1E6
+
+
+def test_nested_peaks():
+    with Instrument.timer('outer', memory=True) as outer:
+        big = np.ones(int(40*MB/8))
+        del big
+        with Instrument.timer('inner', memory=True) as inner:
+            small = np.ones(int(4*MB/8))
+            del small
+        with Instrument.timer('inner2', memory=True) as inner2:
+            pass
+    assert not tracemalloc.is_tracing()
+    assert 4*MB <= inner.peak < 10*MB
+    assert inner2.peak < 1*MB
+    assert outer.peak >= 40*MB
+
+
+def test_peak_inside_inner():
+    with Instrument.timer('outer', memory=True) as outer:
+        with Instrument.timer('inner', memory=True) as inner:
+            with Instrument.timer('innermost', memory=True):
+                big = np.ones(int(40*MB/8))
+                del big
+    assert inner.peak >= 40*MB
+    assert outer.peak >= 40*MB
+    assert not Instrument._peaks()
+
+
+def test_no_memory():
+    with Instrument.timer('plain') as t:
+        pass
+    assert t.peak is None and t.seconds >= 0
+
+
+def test_recursive_decorator():
+    @Instrument.timer('depth', memory=True)
+    def depth(n):
+        time.sleep(.01)
+        if n:
+            depth(n-1)
+
+    with Instrument.capture() as records:
+        depth(3)
+    seconds = [r.fields['seconds'] for r in records if getattr(r, 'event', None) == 'timer']
+    # innermost call logs first, each call includes the ones it made
+    assert len(seconds) == 4
+    assert all(b > a + .009 for a, b in zip(seconds, seconds[1:]))
+    assert not tracemalloc.is_tracing()
+    assert not Instrument._peaks()
+
+
+def test_threads_decorator():
+    @Instrument.timer('sleep')
+    def sleep(t):
+        time.sleep(t)
+
+    with Instrument.capture() as records:
+        threads = [threading.Thread(target=sleep, args=(t,)) for t in (.05, .01, .03)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    seconds = sorted(r.fields['seconds'] for r in records if getattr(r, 'event', None) == 'timer')
+    # each call timed from its own start
+    assert all(t <= s < t + .5 for t, s in zip((.01, .03, .05), seconds))
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""LiveScan.run on a ToolDAQ serial feed."""
+from pathlib import Path
+
+import numpy as np
+
+import LiveScan
+import ScanCache
+
+DATA = Path(__file__).resolve().parents[1].joinpath('data')
+
+
+class FakePort(object):
+    """
+    ToolDAQ like port: time, encoder and load lines, with read timeouts.
+
+    Every gap lines a readline times out (returns b''), once in the middle
+    of a line. The port closes when it has sent everything.
+    """
+
+    def __init__(self, passes=4, gap=50):
+        up = np.arange(3900, 6701, 10)
+        enc = np.concatenate([up if i % 2 == 0 else up[::-1] for i in range(passes)])
+        load = 100 + enc/100
+        self.lines = ['{} {} {}\r\n'.format(i*.01, e, l).encode()
+                      for i, (e, l) in enumerate(zip(enc, load))]
+        self.gap = gap
+        self.i = 0
+        self.reads = 0
+        self.timeouts = 0
+        self.is_open = True
+
+    def readline(self):
+        self.reads += 1
+        if not self.lines:
+            self.is_open = False
+            return b''
+        if self.reads % self.gap == 0:
+            self.timeouts += 1
+            return b''
+        line = self.lines.pop(0)
+        if self.reads % self.gap == self.gap//2:
+            # cut by the timeout, the rest comes with the next read
+            self.lines.insert(0, line[5:])
+            return line[:5]
+        return line
+
+
+def test_run_serial_feed():
+    port = FakePort()
+    source = LiveScan.SerialSource(port)
+    scan = LiveScan.run(source, lines=16)
+    assert port.timeouts > 1
+    assert scan.passes == 4
+    mn, std, n, SEM, encm = scan.fmeans
+    np.testing.assert_allclose(n, 2)
+    np.testing.assert_allclose(mn, 100 + encm, atol=1E-9)
+    assert encm.min() >= 41 and encm.max() <= 65
+
+
+def test_run_stopped_by_callback():
+    source = LiveScan.SerialSource(FakePort(gap=3))
+    chunks = []
+    LiveScan.run(source, lines=16, callback=lambda s: chunks.append(s.samples) or
+                 len(chunks) == 3)
+    assert len(chunks) == 3
+    assert not source.done
+
+
+def test_run_idle():
+    port = FakePort(passes=1)
+    port.readline = lambda: b''
+    scan = LiveScan.run(LiveScan.SerialSource(port), idle=.05)
+    assert scan.samples == 0
+    assert port.lines
+
+
+def test_replay_through_parser():
+    # a recorded scan printed as DAQ lines and parsed back, as from the serial port
+    source = LiveScan.replay(DATA.joinpath('example'), 'b-example.tdms', speed=0)
+    scan = LiveScan.run(source, llim=40, ulim=65)
+    assert source.done
+    data = ScanCache.from_tdms(DATA.joinpath('example', 'b-example.tdms'))
+    direct = LiveScan.StreamScan(llim=40, ulim=65)
+    direct.feed(data['time'], data['encoder'], data['laser'], data['load'])
+    direct.close()
+    assert scan.samples == data['time'].shape[0]
+    assert scan.passes == direct.passes > 0
+    for d in 'fb':
+        for a, b in zip(scan.means(d), direct.means(d)):
+            np.testing.assert_array_equal(a, b)
+
+
+def test_replay_tooldaq_columns():
+    # load scan replayed with the ToolDAQ columns, run averages the load
+    data = ScanCache.from_tdms(DATA.joinpath('example', 'l-example.tdms'))
+    columns = ('time', 'encoder', 'load')
+    source = LiveScan.SerialSource(LiveScan.ReplaySource(data, speed=0, columns=columns))
+    scan = LiveScan.run(source, llim=40, ulim=65)
+    direct = LiveScan.StreamScan(llim=40, ulim=65)
+    direct.feed(data['time'], data['encoder'], data['load'])
+    direct.close()
+    for a, b in zip(scan.fmeans, direct.fmeans):
+        np.testing.assert_array_equal(a, b)
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""TdmsTail on tdms files written while it reads them."""
+import io
+import struct
+from pathlib import Path
+
+import numpy as np
+import pytest
+from nptdms import ChannelObject, RootObject, TdmsFile, TdmsWriter
+
+import ScanCache
+import TdmsTail
+
+DATA = Path(__file__).resolve().parents[1].joinpath('data')
+
+
+def segments(raw):
+    """(start, end) of each segment of a finished tdms file."""
+    out = []
+    pos = 0
+    while pos < len(raw):
+        nxt = struct.unpack_from('<Q', raw, pos + 12)[0]
+        out.append((pos, pos + TdmsTail.LEAD_IN + nxt))
+        pos = out[-1][1]
+    return out
+
+
+def grow(raw, path, steps):
+    """
+    Tail path while raw is written to it in steps of bytes.
+
+    The segment being written has an open lead-in until all of it is on
+    disk, as LabVIEW leaves it, so segments close between polls.
+    """
+    tail = TdmsTail.TdmsTail(path)
+    reads = []
+    k = 0
+    for step in steps:
+        k = min(k + step, len(raw))
+        buf = bytearray(raw[:k])
+        for start, end in segments(raw):
+            if start + TdmsTail.LEAD_IN <= k < end:
+                buf[start+12:start+20] = struct.pack('<Q', TdmsTail.OPEN_SEGMENT)
+        path.write_bytes(bytes(buf))
+        reads.append(tail.read())
+        if k == len(raw):
+            break
+    reads.append(tail.read())
+    return {name: np.concatenate([r[name] for r in reads]) for name in reads[0]}
+
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_growing_scan(tmp_path, seed):
+    source = DATA.joinpath('example', 'b-example.tdms')
+    raw = source.read_bytes()
+    steps = np.random.default_rng(seed).integers(1000, 50000, len(raw)//1000)
+    out = grow(raw, tmp_path.joinpath('scan.tdms'), steps)
+    full = ScanCache.from_tdms(source)
+    assert set(out) == set(full)
+    for name in full:
+        np.testing.assert_array_equal(out[name], full[name])
+
+
+def short_chunk_file():
+    """Metadata only segment, a segment with a short last chunk, then a whole one."""
+    f = io.BytesIO()
+    with TdmsWriter(f) as writer:
+        writer.write_segment([RootObject({'name': 'scan'})])
+        for start in (0, 100):
+            writer.write_segment([
+                ChannelObject('Untitled', 'encoder', np.arange(start, start+10.)),
+                ChannelObject('Untitled', 'laser', -np.arange(start, start+10.))])
+    raw = bytearray(f.getvalue())
+    # cut 40 bytes off the data of the first data segment
+    start, end = segments(bytes(raw))[1]
+    del raw[end-40:end]
+    raw[start+12:start+20] = struct.pack('<Q', end - 40 - start - TdmsTail.LEAD_IN)
+    return bytes(raw)
+
+
+def test_short_last_chunk(tmp_path):
+    raw = short_chunk_file()
+    path = tmp_path.joinpath('short.tdms')
+    path.write_bytes(raw)
+    full = TdmsFile.read(path)['Untitled']
+    whole = TdmsTail.TdmsTail(path).read()
+    # 120 of 160 bytes, 7 values each
+    assert whole['encoder'].shape[0] == 17
+    for name in ('encoder', 'laser'):
+        np.testing.assert_array_equal(whole[name], full[name][:])
+    for step in (1, 7, 30, 64):
+        out = grow(raw, tmp_path.joinpath('grow{}.tdms'.format(step)), [step]*len(raw))
+        for name in ('encoder', 'laser'):
+            np.testing.assert_array_equal(out[name], full[name][:])
+
+
+def test_follow_keeps_samples_ahead(tmp_path):
+    # laser lags the other channels in the first segment and catches up in the second
+    parts = []
+    for n, m in ((10, 6), (4, 8)):
+        f = io.BytesIO()
+        with TdmsWriter(f) as writer:
+            writer.write_segment([ChannelObject('Untitled', 'Untitled', np.arange(n)*.01),
+                                  ChannelObject('Untitled', 'encoder', np.full(n, 5000.)),
+                                  ChannelObject('Untitled', 'laser', np.ones(m))])
+        parts.append(f.getvalue())
+    path = tmp_path.joinpath('follow.tdms')
+    path.write_bytes(parts.pop(0))
+
+    def append(scan):
+        # the second segment arrives after the first read
+        with open(path, 'ab') as f:
+            f.write(parts.pop() if parts else b'')
+
+    scan = TdmsTail.follow(path, poll=.01, idle=.1, callback=append)
+    assert scan.samples == 14